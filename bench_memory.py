@@ -0,0 +1,121 @@
+"""
+Memory benchmark for the reservations of railway_Phase3.
+
+Builds the same reservations twice and prints how many bytes a reservation costs in each:
+the baseline is the original code, dict based objects (a __dict__ and property pairs on
+every object, capacities as deep-copied dicts, datetime objects for times) kept in a plain
+list; the current one is the slotted objects (integer minutes for times) kept in a
+Reservation_Store with every dict it maintains: the store itself, the vehicle's and user's
+reservations, the which_reservation index and the age index. The last line shows the part
+of that cost which is the Reservation_Store.
+
+usage: python bench_memory.py [reservations] [users] [vehicles]
+"""
+import sys
+import tracemalloc
+from copy import deepcopy
+from datetime import datetime, timedelta
+
+from railway_Phase3 import Reservation, Reservation_Store, Seat_Counts, User, Vehicle, parse_time
+
+
+class Legacy_Vehicle:
+    # the Vehicle of the original code, kept here only to be measured.
+    def __init__(self, vehicle_type, origin, destination, dep_time, capacity:dict):
+        self._vehicle_type = vehicle_type
+        self._origin = origin
+        self._destination = destination
+        self._dep_time = dep_time
+        self._capacity = capacity
+        self._cancelation_request = []
+        self._age_limitation = 1000
+        self.time_limit = False
+        self.start_time = None
+        self.end_time = None
+        self.active_times_limitation = False
+        self.active_times_limitation_for_else = False
+        self.last_reservation = None
+        self.reservation_step = None
+        self.reserves_in_this_step = 0
+        self.reserve_limit = 0
+        self.primary_capacity = deepcopy(capacity)
+        self.const_primary_capacity = deepcopy(capacity)
+
+    @property
+    def capacity(self):
+        return self._capacity
+
+
+class Legacy_User:
+    def __init__(self, name, age):
+        self._name = name
+        self._age = age
+        self._last_cancelation = None
+        self._reservation_date_record = []
+
+    @property
+    def name(self):
+        return self._name
+
+
+class Legacy_Reservation:
+    def __init__(self, user, vehicle, time, seat_type):
+        self._user = user
+        self._vehicle = vehicle
+        self._time = time
+        self._seat_type = seat_type
+
+    @property
+    def user(self):
+        return self._user
+
+
+def datetime_minutes(minutes:int):
+    return datetime(2023, 5, 1) + timedelta(minutes=minutes)
+
+
+def int_minutes(minutes:int):
+    return parse_time("2023/05/01-00:00") + minutes
+
+
+def build(vehicle_cls, user_cls, reservation_cls, capacity, time, reservations_count, users_count, vehicles_count, store = None) -> list:
+    vehicles = [vehicle_cls("Train", "Tehran", "City" + str(i), time(60 * i), capacity()) for i in range(vehicles_count)]
+    users = [user_cls("user" + str(i), 20 + i % 50) for i in range(users_count)]
+    reservations = []
+    for i in range(reservations_count):
+        reservation = reservation_cls(users[i % users_count], vehicles[i % vehicles_count], time(i), str(i % 3))
+        if store != None:
+            store.add(reservation)
+        reservations.append(reservation)
+    return [vehicles, users, reservations, store]
+
+
+def bytes_per_reservation(reservations_count, *args, **kwargs) -> float:
+    tracemalloc.start()
+    objects = build(*args, reservations_count=reservations_count, **kwargs)
+    used, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del objects
+    return used / reservations_count
+
+
+def main():
+    reservations_count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    users_count = int(sys.argv[2]) if len(sys.argv) > 2 else 10000
+    vehicles_count = int(sys.argv[3]) if len(sys.argv) > 3 else 1000
+
+    baseline = bytes_per_reservation(reservations_count, Legacy_Vehicle, Legacy_User, Legacy_Reservation, lambda: {'0': 100, '1': 20, '2': 10}, datetime_minutes,
+                                     users_count=users_count, vehicles_count=vehicles_count)
+    current = bytes_per_reservation(reservations_count, Vehicle, User, Reservation, lambda: Seat_Counts([100, 20, 10]), int_minutes,
+                                    users_count=users_count, vehicles_count=vehicles_count, store=Reservation_Store())
+    objects_only = bytes_per_reservation(reservations_count, Vehicle, User, Reservation, lambda: Seat_Counts([100, 20, 10]), int_minutes,
+                                         users_count=users_count, vehicles_count=vehicles_count)
+
+    print("reservations: " + str(reservations_count) + ", users: " + str(users_count) + ", vehicles: " + str(vehicles_count))
+    print("baseline (dict based objects in a list):     %8.1f bytes per reservation" % baseline)
+    print("current (slotted objects, Reservation_Store): %8.1f bytes per reservation" % current)
+    print("  of which the Reservation_Store:             %8.1f bytes per reservation" % (current - objects_only))
+
+
+if __name__ == "__main__":
+    main()
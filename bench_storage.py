@@ -0,0 +1,107 @@
+"""
+Throughput benchmark of the reservation stores of railway_Phase3.
+
+For every size it generates an input of that many commands in time order: bookings, about
+one cancelation for every five bookings and, every 100000 commands, an age limit and a
+capacity cut. The input is run through a Railway_System with the in-memory store
+(storage "objects") and with the SQLite store on a temporary database file (storage
+"sqlite"), the way main runs it: the vehicle lines by load_vehicles, the commands by
+parse_command and execute, and close at the end. It prints the commands per second of each
+and the reservations still live at the end. The 10^7 run takes a long time, and the
+in-memory store needs a few GB for it.
+
+usage: python bench_storage.py [commands ...] (default 100000 1000000 10000000)
+"""
+import os
+import sys
+import tempfile
+import time
+
+from railway_Phase3 import Railway_System, Result_Sink, format_time, load_vehicles, parse_time, read_commands, read_vehicles
+
+VEHICLES_COUNT = 1000
+USERS_COUNT = 10000
+RULES_EVERY = 100000
+
+
+class Counting_Sink(Result_Sink):
+    # counts the results instead of keeping them, so the sink doesn't grow with the input.
+
+    def __init__(self):
+        self.count = 0
+
+    def write(self, message:str, event:str = None, index:int = None):
+        self.count += 1
+
+
+def vehicle_lines(commands_count:int) -> list:
+    # the departures are after every command, with room for about all the bookings.
+    capacity = commands_count // VEHICLES_COUNT + 10
+    start = parse_time("2060/01/01-00:00")
+    lines = [str(VEHICLES_COUNT)]
+    for i in range(VEHICLES_COUNT):
+        vehicle_type = "Train" if i % 2 == 0 else "Airplane"
+        lines.append(vehicle_type + " Tehran City" + str(i % 100) + " " + format_time(start + 60 * i) + " " + str(capacity) + " 2")
+        lines.append(str(capacity // 4) + " " + str(capacity // 8))
+    return lines
+
+
+def booking(i:int) -> list:
+    # the words of the i-th command if it is a booking, without time and age. a user's first
+    # booking is a normal seat, VIP seats need an earlier reservation.
+    seat_type = str(i % 3) if i >= USERS_COUNT else "0"
+    return ["user" + str(i % USERS_COUNT), "Tehran", "City" + str(i % 100), "Train" if i % 2 == 0 else "Airplane", seat_type]
+
+
+def command_lines(commands_count:int):
+    # one command a minute. a cancelation asks for a booking made a few commands before.
+    start = parse_time("2023/05/01-00:00")
+    yield str(commands_count)
+    for i in range(commands_count):
+        time_text = format_time(start + i)
+        if i % RULES_EVERY == RULES_EVERY - 2:
+            yield time_text + " Reserve train baraye afrad bala 65 sal mamnoo ast"
+        elif i % RULES_EVERY == RULES_EVERY - 1:
+            yield time_text + " Zarfiat reserve baraye airplane ha 95 darsad ast"
+        elif i % 6 == 5:
+            yield " ".join([time_text] + booking(i - 5 - i // 6 % 2 * 3) + ["cancel"])
+        else:
+            words = booking(i)
+            yield " ".join([time_text] + words[:4] + [str(20 + i % USERS_COUNT % 50), words[4]])
+
+
+def run(storage:str, commands_count:int, storage_options:dict = None) -> tuple:
+    sink = Counting_Sink()
+    system = Railway_System(storage, sink, storage_options)
+    load_vehicles(system, *read_vehicles(iter(vehicle_lines(commands_count))))
+
+    errors:list = []
+    begin = time.perf_counter()
+    for command in read_commands(command_lines(commands_count), errors):
+        system.execute(command)
+    system.close()
+    seconds = time.perf_counter() - begin
+    if len(errors) != 0:
+        raise RuntimeError("bad generated command: " + str(errors[0]))
+    return (commands_count / seconds, sum(system.occupancy_per_route().values()), sink.count)
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [100000, 1000000, 10000000]
+    for commands_count in sizes:
+        print("commands: " + str(commands_count))
+        in_memory = run("objects", commands_count)
+        directory = tempfile.mkdtemp()
+        path = os.path.join(directory, "bench.db")
+        try:
+            on_disk = run("sqlite", commands_count, {"path": path})
+        finally:
+            if os.path.exists(path):
+                os.remove(path)
+            os.rmdir(directory)
+        for storage, (speed, live, results) in (("objects", in_memory), ("sqlite", on_disk)):
+            print("  %-8s %12.0f commands/s   %d live reservations, %d results" % (storage, speed, live, results))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,184 @@
-from datetime import datetime, timedelta, time
-from collections import OrderedDict
-from copy import deepcopy
+import sys
+import argparse
+import csv
+import json
+import mmap
+import os
+import shutil
+import sqlite3
+import struct
+import tempfile
+import threading
+import time
+import zlib
+from abc import ABC, abstractmethod
+from datetime import datetime
+from collections import OrderedDict, deque
+from functools import lru_cache
+from array import array
+from bisect import bisect_left, bisect_right
+from heapq import heappush, heappop, merge
+
+try:
+    import numpy as np
+except ImportError:     # numpy is only needed by the "columnar" storage.
+    np = None
+
+
+# times are kept as integer minutes since 1970/01/01-00:00, parse_time turns the "%Y/%m/%d-%H:%M" strings into them.
+MINUTES_PER_DAY = 1440
+DAYS_IN_MONTH = (0, 31, 28, 31, 30, 31, 30, 31, 31, 30, 31, 30, 31)
+
+
+def days_from_civil(year:int, month:int, day:int) -> int:
+    # days since 1970/01/01 of a date in the proleptic Gregorian calendar.
+    year -= month <= 2
+    era = year // 400
+    year_of_era = year - era * 400
+    day_of_year = (153 * (month - 3 if month > 2 else month + 9) + 2) // 5 + day - 1
+    day_of_era = year_of_era * 365 + year_of_era // 4 - year_of_era // 100 + day_of_year
+    return era * 146097 + day_of_era - 719468
+
+
+def civil_from_days(days:int) -> tuple:
+    # the (year, month, day) of days since 1970/01/01, the inverse of days_from_civil.
+    days += 719468
+    era = days // 146097
+    day_of_era = days - era * 146097
+    year_of_era = (day_of_era - day_of_era // 1460 + day_of_era // 36524 - day_of_era // 146096) // 365
+    day_of_year = day_of_era - (365 * year_of_era + year_of_era // 4 - year_of_era // 100)
+    month_index = (5 * day_of_year + 2) // 153
+    day = day_of_year - (153 * month_index + 2) // 5 + 1
+    month = month_index + 3 if month_index < 10 else month_index - 9
+    return (year_of_era + era * 400 + (month <= 2), month, day)
+
+
+@lru_cache(maxsize=4096)
+def parse_time(time_str:str) -> int:
+    # "%Y/%m/%d-%H:%M" to minutes since 1970/01/01-00:00.
+    # commands of the same minute share their timestamp, so the results are cached.
+    if len(time_str) == 16 and time_str[4] == '/' and time_str[7] == '/' and time_str[10] == '-' and time_str[13] == ':' and (time_str[:4] + time_str[5:7] + time_str[8:10] + time_str[11:13] + time_str[14:]).isdigit():
+        year, month, day, hour, minute = int(time_str[:4]), int(time_str[5:7]), int(time_str[8:10]), int(time_str[11:13]), int(time_str[14:])
+        leap_day = month == 2 and year % 4 == 0 and (year % 100 != 0 or year % 400 == 0)
+        if 1 <= month <= 12 and 1 <= day <= DAYS_IN_MONTH[month] + leap_day and hour < 24 and minute < 60:
+            return days_from_civil(year, month, day) * MINUTES_PER_DAY + hour * 60 + minute
+    # not fixed-width (e.g. "2023/5/1-9:05") or not a real date; strptime accepts the first and raises for the second.
+    the_time = datetime.strptime(time_str, "%Y/%m/%d-%H:%M")
+    return days_from_civil(the_time.year, the_time.month, the_time.day) * MINUTES_PER_DAY + the_time.hour * 60 + the_time.minute
+
+
+def format_time(minutes:int) -> str:
+    # minutes since 1970/01/01-00:00 to "%Y/%m/%d-%H:%M", the inverse of parse_time.
+    year, month, day = civil_from_days(minutes // MINUTES_PER_DAY)
+    return "%04d/%02d/%02d-%02d:%02d" % (year, month, day, minutes % MINUTES_PER_DAY // 60, minutes % 60)
+
+
+def day_start(minutes:int) -> int:
+    return minutes - minutes % MINUTES_PER_DAY
+
+
+def month_start(minutes:int) -> int:
+    year, month, day = civil_from_days(minutes // MINUTES_PER_DAY)
+    return days_from_civil(year, month, 1) * MINUTES_PER_DAY
+
+
+class Symbol_Table:
+    """
+    Every distinct name of the input (cities, usernames, vehicle types) stored once.
+
+    intern returns the one shared string object of a name, so the tuple keys of the
+    timetable and the reservation indexes compare by identity. The canonical capitalization
+    and the lower case of a name are computed once and cached, instead of on every booking,
+    cancelation and rule.
+    """
+
+    __slots__ = ('_names', '_capitalized', '_lowered')
+
+    def __init__(self):
+        self._names:dict = {}           # name as key and its interned string as value.
+        self._capitalized:dict = {}
+        self._lowered:dict = {}
+
+    def __len__(self):
+        return len(self._names)
+
+    def intern(self, name:str) -> str:
+        interned = self._names.get(name)
+        if interned == None:
+            interned = sys.intern(name)
+            self._names[interned] = interned
+        return interned
+
+    def capitalized(self, name:str) -> str:
+        # Railway_System.capitalize_first_letter of name, computed once.
+        capitalized = self._capitalized.get(name)
+        if capitalized == None:
+            capitalized = self._capitalized[self.intern(name)] = self.intern(Railway_System.capitalize_first_letter(name))
+        return capitalized
+
+    def lower(self, name:str) -> str:
+        lowered = self._lowered.get(name)
+        if lowered == None:
+            lowered = self._lowered[self.intern(name)] = name.lower()
+        return lowered
+
+
+# the symbols of the process, names from parsed commands and vehicles are interned here.
+symbols = Symbol_Table()
+
+
+class Seat_Counts:
+    """
+    Seat counts of a vehicle, one integer per seat type in a fixed-size array.
+
+    Seat type '0' is the normal seats and '1' to 'n' are the VIP types, so the seat
+    type string is also the index. It can be used like the dict it replaces:
+    counts['1'], counts['1'] -= 1, '2' in counts, counts.keys().
+    """
+
+    __slots__ = ('_counts',)
+
+    def __init__(self, counts = ()):
+        self._counts = array('l', counts)
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __contains__(self, seat_type):
+        return seat_type.isdigit() and int(seat_type) < len(self._counts)
+
+    def __getitem__(self, seat_type):
+        try:
+            return self._counts[int(seat_type)]
+        except (IndexError, ValueError):
+            raise KeyError(seat_type)
+
+    def __setitem__(self, seat_type, count):
+        try:
+            self._counts[int(seat_type)] = count
+        except (IndexError, ValueError):
+            raise KeyError(seat_type)
+
+    def __eq__(self, other):
+        return isinstance(other, Seat_Counts) and self._counts == other._counts
+
+    def __repr__(self):
+        return "Seat_Counts(" + repr(dict(self.items())) + ")"
+
+    def keys(self) -> list:
+        return [str(i) for i in range(len(self._counts))]
+
+    def values(self) -> list:
+        return list(self._counts)
+
+    def items(self) -> list:
+        return [(str(i), count) for i, count in enumerate(self._counts)]
+
+    def copy(self):
+        return Seat_Counts(self._counts)
 
 
 class Vehicle:
@@ -14,15 +192,15 @@ class Vehicle:
         The start place of the vehicle.
     destination : str
         The destination of the vehicle.
-    dep_time : datetime
-        The time, when the vehicle starts its journey.
-    capacity : int
-        The free seats in this vehicle
+    dep_time : int
+        The time, when the vehicle starts its journey, in minutes (see parse_time).
+    departure_id : int
+        The id of this departure in the timetable.
+    capacity : Seat_Counts
+        The free seats in this vehicle for every seat type.
 
     Methods
     -------
-    Has getter and setter for every attribute.
-
     decrease_capacity(count) -> None:
         decreses capacity for the amount of count.
         when someone reserves, this function is called.
@@ -34,217 +212,923 @@ class Vehicle:
         the default value of count is 1.
     """
 
-    
-    def __init__(self, vehicle_type:str, origin:str, destination:str, dep_time:datetime, capacity:dict):
-        self._vehicle_type:str = None
-        self._origin:str = None
-        self._destination:str = None
-        self._dep_time:datetime = None
-        self._capacity:dict = {}     # capacity is a dictionary with capacity of models and seat type as key.
-        self._cancelation_request:list = []      # a list which contains requests for cancelation when the vehicle is full. Items are objs from Reservation class.
-        self._age_limitation:int = 1000
+    # there are a lot of these objects, so they have slots instead of a __dict__.
+    __slots__ = ('vehicle_type', 'origin', 'destination', 'dep_time', 'capacity', 'primary_capacity', 'const_primary_capacity',
+                 '_cancelation_requests', '_cancelation_request_ids', 'age_limitation', 'time_limit', 'start_time', 'end_time',
+                 'active_times_limitation', 'active_times_limitation_for_else', 'last_reservation', 'reservation_step',
+                 'reserves_in_this_step', 'reserve_limit', 'departure_id', 'route_indexes', 'reservations')
+
+    def __init__(self, vehicle_type:str, origin:str, destination:str, dep_time:int, capacity:Seat_Counts):
+        self._cancelation_requests:dict = {}     # requests for cancelation of VIP seats, seat type as key and a FIFO deque of objs from Reservation class as value.
+        self._cancelation_request_ids:set = set()   # reservation_id of every pending request, a request leaves the queue lazily once its id is discarded here.
+        self.age_limitation:int = 1000
         self.time_limit = False
-        self.start_time = None
-        self.end_time = None
+        self.start_time:int = None      # minute of the day
+        self.end_time:int = None
         self.active_times_limitation = False
         self.active_times_limitation_for_else = False
-        self.last_reservation:datetime = None
-        self.reservation_step:timedelta = None
+        self.last_reservation:int = None
+        self.reservation_step:int = None
         self.reserves_in_this_step = 0
         self.reserve_limit = 0
-        self.vehicle_type = vehicle_type
-        self.origin = origin
-        self.destination = destination
-        self.dep_time = dep_time
-        self.capacity = capacity
-        self.primary_capacity:dict = deepcopy(capacity)
-        self.const_primary_capacity:dict = deepcopy(capacity)
-
-
-    @property
-    def vehicle_type(self):
-        return self._vehicle_type
-    
-    @vehicle_type.setter
-    def vehicle_type(self, vehicle_type):
-        self._vehicle_type = vehicle_type
-
-    @property
-    def origin(self):
-        return self._origin
-    
-    @origin.setter
-    def origin(self, origin):
-        self._origin = origin
-
-    @property
-    def destination(self):
-        return self._destination
-    
-    @destination.setter
-    def destination(self, destination):
-        self._destination = destination
-
-    @property
-    def dep_time(self):
-        return self._dep_time
-    
-    @dep_time.setter
-    def dep_time(self, dep_time):
-        self._dep_time = dep_time
-
-    @property
-    def capacity(self):
-        return self._capacity
-    
-    @capacity.setter
-    def capacity(self, capacity):
-        self._capacity = capacity    
+        self.departure_id:int = None        # given by Timetable when the vehicle is added.
+        self.route_indexes:list = []        # the Route_Departures this vehicle is in, they are told when capacity changes.
+        self.reservations:dict = {}         # live reservations of this vehicle, reservation_id as key, kept by Reservation_Store.
+        self.vehicle_type:str = vehicle_type
+        self.origin:str = origin
+        self.destination:str = destination
+        self.dep_time:int = dep_time
+        if not isinstance(capacity, Seat_Counts):
+            capacity = Seat_Counts(capacity.values())   # a dict with '0' to 'n' as keys, in order.
+        self.capacity:Seat_Counts = capacity
+        self.primary_capacity:Seat_Counts = capacity.copy()
+        self.const_primary_capacity:Seat_Counts = capacity.copy()
 
     @property
     def cancelation_request(self):
-        return self._cancelation_request
-    
-    @property
-    def age_limitation(self):
-        return self._age_limitation
-    
-    @age_limitation.setter
-    def age_limitation(self, age):
-        self._age_limitation = age
+        # pending requests of every seat type.
+        return [reservation for requests in self._cancelation_requests.values() for reservation in requests if reservation.reservation_id in self._cancelation_request_ids]
 
     def is_cancelation_in_list(self, reservation):
-        if reservation in self._cancelation_request:
+        if reservation.reservation_id in self._cancelation_request_ids:
             return True
         return False
 
     def decrease_capacity(self, seat_type, count = 1):
-        self._capacity[seat_type] -= count
+        self.capacity[seat_type] -= count
+        for route in self.route_indexes:
+            route.capacity_changed(self, seat_type)
 
     def increase_capacity(self, seat_type, count = 1):
-        self._capacity[seat_type] += count
+        self.capacity[seat_type] += count
+        for route in self.route_indexes:
+            route.capacity_changed(self, seat_type)
 
     def add_cancelation_request(self, reservation):
-        self._cancelation_request.append(reservation)
-
-    def pop_cancelation_request(self, reservation):
-        self._cancelation_request.pop(0)
+        self._cancelation_requests.setdefault(reservation.seat_type, deque()).append(reservation)
+        self._cancelation_request_ids.add(reservation.reservation_id)
+
+    def pop_cancelation_request(self, seat_type):
+        # returns the oldest pending request for seat_type and removes it, None if there isn't any.
+        requests:deque = self._cancelation_requests.get(seat_type)
+        while requests:
+            reservation = requests.popleft()
+            if reservation.reservation_id in self._cancelation_request_ids:
+                self._cancelation_request_ids.remove(reservation.reservation_id)
+                return reservation
+        return None
 
-    def cancel_done(self):
-        self._cancelation_request.pop(0)
+    def discard_cancelation_request(self, reservation):
+        # called when a reservation is gone some other way, e.g. a rule cancelled it.
+        self._cancelation_request_ids.discard(reservation.reservation_id)
 
 class User:
+    __slots__ = ('name', 'age', 'last_cancelation', 'reservation_date_record', 'reservations')
+
     def __init__(self, name:str, age:int):
-        self._name:str = None
-        self._age:int = None
-        self._last_cancelation:datetime = None
-        self._reservation_date_record:list = []
-        self.name = name
-        self.age = age
+        self.name:str = name
+        self.age:int = age
+        self.last_cancelation:int = None
+        self.reservation_date_record:list = []
+        self.reservations:dict = {}         # live reservations of this user, reservation_id as key, kept by Reservation_Store.
 
+    def add_reservation_record(self, time:int):
+        self.reservation_date_record.append(time)
 
-    @property
-    def name(self):
-        return self._name
-    
-    @name.setter
-    def name(self, name):
-        self._name = name
+    def remove_from_reservation_record(self, time:int):
+        self.reservation_date_record.remove(time)
 
-    @property
-    def age(self):
-        return self._age
+class Reservation:
+    __slots__ = ('reservation_id', 'user', 'vehicle', 'time', 'seat_type')
 
-    @age.setter
-    def age(self, age):
-        self._age = age
+    def __init__(self, user:User, vehicle:Vehicle, time:int, seat_type:str):
+        self.reservation_id:int = None      # given by Reservation_Store when the reservation is added.
+        self.user:User = user
+        self.vehicle:Vehicle = vehicle
+        self.time:int = time
+        self.seat_type:str = seat_type
 
-    @property
-    def last_cancelation(self):
-        return self._last_cancelation
-    
-    @last_cancelation.setter
-    def last_cancelation(self, time:datetime):
-        self._last_cancelation = time
+class Reservation_Store:
+    """
+    An insertion-ordered store for the live reservations.
+
+    Reservations are kept in a dict with their reservation_id as key, so iteration
+    (and reversed iteration) is chronological and removing a reservation is O(1).
+    Every vehicle's and user's reservations dict is kept up to date as well.
+    One index is kept next to it for which_reservation, with
+    (username, vehicle_type, origin, destination, seat_type) as key and a list of
+    reservations in the order they were made as bucket (a bucket rarely holds more than a
+    few, so removing from it is cheap); "Auto" lookups ask it once for every vehicle_type
+    with live reservations. For age limits, the users with live reservations of every vehicle_type
+    are bucketed by age, with their count of such reservations, so older_than only visits
+    the users above the limit and a user's new age moves one entry per vehicle_type;
+    user_age_changed must be called when a user with live reservations gets a new age.
+    """
 
+    def __init__(self):
+        self._reservations:dict = {}
+        self._index:dict = {}
+        self._type_counts:dict = {}     # vehicle_type as key and the count of its live reservations as value.
+        self._age_index:dict = {}       # vehicle_type as key and {age: {user: count of live reservations}} as value.
+        self._next_id:int = 0
+
+    def __len__(self):
+        return len(self._reservations)
+
+    def bind(self, users:dict, vehicles):
+        # gives the store the users and the timetable of its Railway_System; only stores which
+        # don't keep Reservation objects need them.
+        pass
+
+    def commit(self):
+        # makes the changes durable, for stores which keep them outside the process.
+        pass
+
+    def __iter__(self):
+        return iter(self._reservations.values())
+
+    def __reversed__(self):
+        return reversed(self._reservations.values())
+
+    def __contains__(self, reservation:Reservation):
+        return reservation.reservation_id in self._reservations
+
+    def add(self, reservation:Reservation):
+        reservation.reservation_id = self._next_id
+        self._next_id += 1
+        self._reservations[reservation.reservation_id] = reservation
+        reservation.vehicle.reservations[reservation.reservation_id] = reservation
+        reservation.user.reservations[reservation.reservation_id] = reservation
+        self.add_to_age_index(reservation, reservation.user.age)
+        vehicle_type = reservation.vehicle.vehicle_type
+        self._type_counts[vehicle_type] = self._type_counts.get(vehicle_type, 0) + 1
+        key = (reservation.user.name, vehicle_type, reservation.vehicle.origin, reservation.vehicle.destination, reservation.seat_type)
+        self._index.setdefault(key, []).append(reservation)
+
+    def remove(self, reservation:Reservation):
+        del self._reservations[reservation.reservation_id]
+        del reservation.vehicle.reservations[reservation.reservation_id]
+        del reservation.user.reservations[reservation.reservation_id]
+        self.remove_from_age_index(reservation, reservation.user.age)
+        vehicle_type = reservation.vehicle.vehicle_type
+        Reservation_Store.count_down(self._type_counts, vehicle_type)
+        key = (reservation.user.name, vehicle_type, reservation.vehicle.origin, reservation.vehicle.destination, reservation.seat_type)
+        Reservation_Store.remove_from_index(self._index, key, reservation)
+
+    def find(self, username, vehicle_type, origin, destination, seat_type, departure:Vehicle = None) -> Reservation:
+        # returns the oldest live reservation with this key, vehicle_type "Auto" matches every vehicle type.
+        # if departure is given, only reservations of that departure are considered.
+        if vehicle_type == "Auto":
+            found = [self.find(username, live_type, origin, destination, seat_type, departure) for live_type in self._type_counts]
+            return min([reservation for reservation in found if reservation != None], key=Railway_System.reservation_id_key, default=None)
+        reservations = self._index.get((username, vehicle_type, origin, destination, seat_type))
+        if not reservations:
+            return None
+        if departure == None:
+            return reservations[0]
+        for reservation in reservations:
+            if reservation.vehicle is departure:
+                return reservation
+        return None
 
-    def add_reservation_record(self, time:datetime):
-        self._reservation_date_record.append(time)
+    def of_vehicle(self, vehicle:Vehicle) -> list:
+        # the live reservations of a departure, in the order they were made.
+        return list(vehicle.reservations.values())
+
+    def older_than(self, vehicle_type, age:int) -> list:
+        # reservations of vehicle_type whose user is older than age, in the order they were made.
+        ages:dict = self._age_index.get(vehicle_type, {})
+        victims = [reservation for user_age in ages if user_age > age for user in ages[user_age]
+                   for reservation in user.reservations.values() if reservation.vehicle.vehicle_type == vehicle_type]
+        victims.sort(key=Railway_System.reservation_id_key)
+        return victims
+
+    def user_age_changed(self, user:User, old_age:int):
+        for ages in self._age_index.values():
+            users = ages.get(old_age)
+            if users != None and user in users:
+                count = users.pop(user)
+                if len(users) == 0:
+                    del ages[old_age]
+                ages.setdefault(user.age, {})[user] = count
+
+    def add_to_age_index(self, reservation:Reservation, age:int):
+        users = self._age_index.setdefault(reservation.vehicle.vehicle_type, {}).setdefault(age, {})
+        users[reservation.user] = users.get(reservation.user, 0) + 1
+
+    def remove_from_age_index(self, reservation:Reservation, age:int):
+        ages = self._age_index[reservation.vehicle.vehicle_type]
+        Reservation_Store.count_down(ages[age], reservation.user)
+        if len(ages[age]) == 0:
+            del ages[age]
+
+    def overbooked(self, vehicles:list) -> list:
+        # for every seat type with negative capacity on these vehicles, the latest reservations that
+        # have to go to bring it back to 0. the result is sorted latest reservation first.
+        victims:list = []
+        for vehicle in vehicles:
+            overbooked = {key: -vehicle.capacity[key] for key in vehicle.capacity.keys() if vehicle.capacity[key] < 0}
+            for reservation in reversed(vehicle.reservations.values()):
+                if len(overbooked) == 0:
+                    break
+                if reservation.seat_type in overbooked:
+                    victims.append(reservation)
+                    overbooked[reservation.seat_type] -= 1
+                    if overbooked[reservation.seat_type] == 0:
+                        del overbooked[reservation.seat_type]
+        victims.sort(key=Railway_System.reservation_id_key, reverse=True)
+        return victims
+
+    def occupancy(self) -> dict:
+        # departure_id as key and the count of its live reservations as value.
+        counts:dict = {}
+        for reservation in self._reservations.values():
+            counts[reservation.vehicle.departure_id] = counts.get(reservation.vehicle.departure_id, 0) + 1
+        return counts
+
+    def last(self) -> Reservation:
+        if len(self._reservations) == 0:
+            return None
+        return next(reversed(self._reservations.values()))
 
-    def remove_from_reservation_record(self, time:datetime):
-        self._reservation_date_record.remove(time)
+    @staticmethod
+    def remove_from_index(index:dict, key, reservation:Reservation):
+        reservations = index[key]
+        reservations.remove(reservation)
+        if len(reservations) == 0:
+            del index[key]
 
-    @property
-    def reservation_date_record(self):
-        return self._reservation_date_record
+    @staticmethod
+    def count_down(counts:dict, key):
+        counts[key] -= 1
+        if counts[key] == 0:
+            del counts[key]
 
-class Reservation:
-    def __init__(self, user:User, vehicle:Vehicle, time:datetime, seat_type:str):
-        self._user:User = None
-        self._vehicle:Vehicle = None
-        self._time:datetime = None
-        self._seat_type:str = None
-        self.user = user
-        self.vehicle = vehicle
-        self.time = time
-        self.seat_type = seat_type
 
+class Columnar_Reservation_Store(Reservation_Store):
+    """
+    A Reservation_Store that also keeps the reservations as NumPy columns.
+
+    Every live reservation has a row: its reservation_id, the interned user id, the vehicle's
+    departure_id, the interned vehicle_type, the reservation time in minutes, the seat type,
+    the user's age and a validity mask. The row of a removed reservation is reused by the
+    next one added, so the columns are as long as the most reservations ever live at once,
+    not as the count ever made; they grow by doubling. The rule methods pick their victims
+    with vectorized masks (older_than, overbooked) and occupancy is a bincount.
+
+    The Reservation objects and the which_reservation index of Reservation_Store are kept
+    too, for lookups and for the objects the rules return, so this store takes more memory
+    than the default one; only the age index is left out, the age column replaces it.
+    """
 
-    @property
-    def user(self):
-        return self._user
-    
-    @user.setter
-    def user(self, user):
-        self._user = user
+    def __init__(self, size:int = 1024):
+        if np == None:
+            raise ImportError("the columnar storage needs numpy")
+        super().__init__()
+        self._users:dict = {}           # username as key and its interned id as value.
+        self._vehicle_types:dict = {}   # vehicle_type as key and its interned id as value.
+        self._rows:dict = {}            # reservation_id as key and its row as value.
+        self._free_rows:list = []       # rows of removed reservations, reused first.
+        self._row_count = 0             # rows ever used, live or free.
+        self._id = np.zeros(size, dtype=np.int64)
+        self._user = np.zeros(size, dtype=np.int32)
+        self._vehicle = np.zeros(size, dtype=np.int32)
+        self._vehicle_type = np.zeros(size, dtype=np.int16)
+        self._time = np.zeros(size, dtype=np.int64)
+        self._seat = np.zeros(size, dtype=np.int16)
+        self._age = np.zeros(size, dtype=np.int16)
+        self._valid = np.zeros(size, dtype=bool)
+
+    def _grow(self, rows:int):
+        size = len(self._valid)
+        while size < rows:
+            size *= 2
+        for name in ('_id', '_user', '_vehicle', '_vehicle_type', '_time', '_seat', '_age', '_valid'):
+            column = getattr(self, name)
+            grown = np.zeros(size, dtype=column.dtype)
+            grown[:len(column)] = column
+            setattr(self, name, grown)
+
+    def add(self, reservation:Reservation):
+        super().add(reservation)
+        if len(self._free_rows) != 0:
+            row = self._free_rows.pop()
+        else:
+            row = self._row_count
+            self._row_count += 1
+            if row >= len(self._valid):
+                self._grow(row + 1)
+        self._rows[reservation.reservation_id] = row
+        self._id[row] = reservation.reservation_id
+        self._user[row] = self._users.setdefault(reservation.user.name, len(self._users))
+        self._vehicle[row] = reservation.vehicle.departure_id
+        self._vehicle_type[row] = self._vehicle_types.setdefault(reservation.vehicle.vehicle_type, len(self._vehicle_types))
+        self._time[row] = reservation.time
+        self._seat[row] = int(reservation.seat_type)
+        self._age[row] = reservation.user.age
+        self._valid[row] = True
+
+    def remove(self, reservation:Reservation):
+        super().remove(reservation)
+        row = self._rows.pop(reservation.reservation_id)
+        self._valid[row] = False
+        self._free_rows.append(row)
+
+    def add_to_age_index(self, reservation:Reservation, age:int):
+        pass
+
+    def remove_from_age_index(self, reservation:Reservation, age:int):
+        pass
+
+    def user_age_changed(self, user:User, old_age:int):
+        if len(user.reservations) != 0:
+            self._age[np.fromiter([self._rows[reservation_id] for reservation_id in user.reservations], dtype=np.int64)] = user.age
+
+    def live_rows(self):
+        return np.nonzero(self._valid[:self._row_count])[0]
+
+    def rows_of_type(self, vehicle_type):
+        if vehicle_type not in self._vehicle_types:
+            return np.zeros(0, dtype=np.int64)
+        rows = self._row_count
+        return np.nonzero(self._valid[:rows] & (self._vehicle_type[:rows] == self._vehicle_types[vehicle_type]))[0]
+
+    def older_than(self, vehicle_type, age:int) -> list:
+        rows = self.rows_of_type(vehicle_type)
+        reservation_ids = np.sort(self._id[rows[self._age[rows] > age]])
+        return [self._reservations[int(reservation_id)] for reservation_id in reservation_ids]
+
+    def overbooked(self, vehicles:list) -> list:
+        # how many reservations every (vehicle, seat type) has to lose, as sorted group keys.
+        seat_types = 1 + max([len(vehicle.capacity) for vehicle in vehicles], default=0)
+        deficits:dict = {}
+        for vehicle in vehicles:
+            for key in vehicle.capacity.keys():
+                if vehicle.capacity[key] < 0:
+                    deficits[vehicle.departure_id * seat_types + int(key)] = -vehicle.capacity[key]
+        if len(deficits) == 0:
+            return []
+        keys = np.array(sorted(deficits), dtype=np.int64)
+        limits = np.array([deficits[key] for key in keys], dtype=np.int64)
+
+        # reservations of the overbooked groups, grouped and latest first inside every group
+        rows = self.live_rows()
+        groups = self._vehicle[rows].astype(np.int64) * seat_types + self._seat[rows]
+        pos = np.minimum(np.searchsorted(keys, groups), len(keys) - 1)
+        matched = keys[pos] == groups
+        reservation_ids, groups, pos = self._id[rows[matched]], groups[matched], pos[matched]
+        order = np.lexsort((-reservation_ids, groups))
+        reservation_ids, groups, pos = reservation_ids[order], groups[order], pos[order]
+
+        # rank of every reservation inside its group, from the cumulative group sizes
+        starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+        sizes = np.diff(np.r_[starts, len(groups)])
+        rank = np.arange(len(groups)) - np.repeat(starts, sizes)
+        victims = np.sort(reservation_ids[rank < limits[pos]])[::-1]
+        return [self._reservations[int(reservation_id)] for reservation_id in victims]
+
+    def occupancy(self) -> dict:
+        counts = np.bincount(self._vehicle[self.live_rows()])
+        return {int(departure_id): int(counts[departure_id]) for departure_id in np.flatnonzero(counts)}
+
+
+class Sqlite_Reservation_Store:
+    """
+    A reservation store kept in a SQLite database instead of in memory.
+
+    It has the methods of Reservation_Store and gives the same answers, but the reservations,
+    their users' ages and their departures are rows, and Reservation objects are only built
+    for the rows a query returns (so they are new objects each time; the users and vehicles
+    in them are the live ones). The indexes are on (username, origin, destination,
+    seat_type), the same with vehicle_type, (departure_id, seat_type) and on the departures'
+    (origin, destination, dep_time). The statements are constant strings, so sqlite3 keeps
+    them prepared, and the changes are committed in one transaction per batch_size changes
+    or on commit. path "" is a private temporary database on disk; Railway_System passes
+    path and batch_size in its storage_options (--db and --db-batch).
+
+    Only the reservations are bounded by the disk: the users, with the reservation_date_record
+    every booking appends to, the timetable and the VIP cancelation queues stay in memory, in
+    the Railway_System. A database file holds the reservations of one system, so it can't be
+    reused without that system's users and departures (a snapshot of it is restored into an
+    empty one).
+    """
 
-    @property
-    def vehicle(self):
-        return self._vehicle
-    
-    @vehicle.setter
-    def vehicle(self, vehicle:Vehicle):
-        self._vehicle = vehicle
+    schema = (
+        "CREATE TABLE IF NOT EXISTS departures (departure_id INTEGER PRIMARY KEY, vehicle_type TEXT, origin TEXT, destination TEXT, dep_time INTEGER)",
+        "CREATE INDEX IF NOT EXISTS departures_route ON departures (origin, destination, dep_time)",
+        "CREATE TABLE IF NOT EXISTS users (name TEXT PRIMARY KEY, age INTEGER)",
+        "CREATE TABLE IF NOT EXISTS reservations (reservation_id INTEGER PRIMARY KEY, username TEXT, departure_id INTEGER, vehicle_type TEXT, "
+        "origin TEXT, destination TEXT, seat_type TEXT, time INTEGER)",
+        "CREATE INDEX IF NOT EXISTS reservations_auto ON reservations (username, origin, destination, seat_type)",
+        "CREATE INDEX IF NOT EXISTS reservations_vehicle ON reservations (username, vehicle_type, origin, destination, seat_type)",
+        "CREATE INDEX IF NOT EXISTS reservations_departure ON reservations (departure_id, seat_type)",
+        "CREATE INDEX IF NOT EXISTS reservations_type ON reservations (vehicle_type)",
+    )
+    columns = "reservation_id, username, departure_id, time, seat_type"
+    insert_departure = "INSERT OR IGNORE INTO departures VALUES (?, ?, ?, ?, ?)"
+    insert_user = "INSERT OR REPLACE INTO users VALUES (?, ?)"
+    insert = "INSERT INTO reservations VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+    delete = "DELETE FROM reservations WHERE reservation_id = ?"
+    select_auto = "SELECT " + columns + " FROM reservations WHERE username = ? AND origin = ? AND destination = ? AND seat_type = ? ORDER BY reservation_id LIMIT 1"
+    select_auto_departure = "SELECT " + columns + " FROM reservations WHERE username = ? AND origin = ? AND destination = ? AND seat_type = ? AND departure_id = ? ORDER BY reservation_id LIMIT 1"
+    select_vehicle = "SELECT " + columns + " FROM reservations WHERE username = ? AND vehicle_type = ? AND origin = ? AND destination = ? AND seat_type = ? ORDER BY reservation_id LIMIT 1"
+    select_vehicle_departure = "SELECT " + columns + " FROM reservations WHERE username = ? AND vehicle_type = ? AND origin = ? AND destination = ? AND seat_type = ? AND departure_id = ? ORDER BY reservation_id LIMIT 1"
+    select_older = ("SELECT " + ", ".join("r." + column for column in columns.split(", ")) + " FROM reservations r JOIN users u ON u.name = r.username "
+                    "WHERE r.vehicle_type = ? AND u.age > ? ORDER BY r.reservation_id")
+    select_latest = "SELECT " + columns + " FROM reservations WHERE departure_id = ? AND seat_type = ? ORDER BY reservation_id DESC LIMIT ?"
+    select_departure = "SELECT " + columns + " FROM reservations WHERE departure_id = ? ORDER BY reservation_id"
+    select_occupancy = "SELECT departure_id, COUNT(*) FROM reservations GROUP BY departure_id"
+    select_last = "SELECT " + columns + " FROM reservations ORDER BY reservation_id DESC LIMIT 1"
+    select_all = "SELECT " + columns + " FROM reservations ORDER BY reservation_id"
+    select_all_reversed = "SELECT " + columns + " FROM reservations ORDER BY reservation_id DESC"
+    select_id = "SELECT 1 FROM reservations WHERE reservation_id = ?"
+
+    def __init__(self, path:str = "", batch_size:int = 10000):
+        self._db = sqlite3.connect(path)
+        for statement in Sqlite_Reservation_Store.schema:
+            self._db.execute(statement)
+        self._db.commit()
+        self.batch_size = batch_size
+        self._changes = 0
+        self._count = self._db.execute("SELECT COUNT(*) FROM reservations").fetchone()[0]
+        self._next_id = self._db.execute("SELECT COALESCE(MAX(reservation_id) + 1, 0) FROM reservations").fetchone()[0]
+        self._departures:set = set()    # departure_ids already in the departures table.
+        self._users:dict = {}
+        self._vehicles = None
+
+    def bind(self, users:dict, vehicles):
+        self._users = users
+        self._vehicles = vehicles
+
+    def __len__(self):
+        return self._count
+
+    def __iter__(self):
+        # the rows are read as the iteration goes, not all at once.
+        return (self.reservation(row) for row in self._db.execute(Sqlite_Reservation_Store.select_all))
+
+    def __reversed__(self):
+        return (self.reservation(row) for row in self._db.execute(Sqlite_Reservation_Store.select_all_reversed))
+
+    def __contains__(self, reservation:Reservation):
+        return self._db.execute(Sqlite_Reservation_Store.select_id, (reservation.reservation_id, )).fetchone() != None
+
+    def reservation(self, row:tuple) -> Reservation:
+        # a Reservation object for a row of the columns.
+        reservation_id, username, departure_id, time, seat_type = row
+        reservation = Reservation(self._users[username], self._vehicles.get(departure_id), time, seat_type)
+        reservation.reservation_id = reservation_id
+        return reservation
+
+    def changed(self):
+        self._changes += 1
+        if self._changes >= self.batch_size:
+            self.commit()
+
+    def commit(self):
+        self._db.commit()
+        self._changes = 0
+
+    def add(self, reservation:Reservation):
+        reservation.reservation_id = self._next_id
+        self._next_id += 1
+        vehicle = reservation.vehicle
+        if vehicle.departure_id not in self._departures:
+            self._db.execute(Sqlite_Reservation_Store.insert_departure, (vehicle.departure_id, vehicle.vehicle_type, vehicle.origin, vehicle.destination, vehicle.dep_time))
+            self._departures.add(vehicle.departure_id)
+        self._db.execute(Sqlite_Reservation_Store.insert_user, (reservation.user.name, reservation.user.age))
+        self._db.execute(Sqlite_Reservation_Store.insert, (reservation.reservation_id, reservation.user.name, vehicle.departure_id, vehicle.vehicle_type,
+                                                           vehicle.origin, vehicle.destination, reservation.seat_type, reservation.time))
+        self._count += 1
+        self.changed()
+
+    def remove(self, reservation:Reservation):
+        self._db.execute(Sqlite_Reservation_Store.delete, (reservation.reservation_id, ))
+        self._count -= 1
+        self.changed()
+
+    def find(self, username, vehicle_type, origin, destination, seat_type, departure:Vehicle = None) -> Reservation:
+        # the oldest live reservation with this key, like Reservation_Store.find.
+        if vehicle_type == "Auto":
+            key = (username, origin, destination, seat_type)
+            statement = Sqlite_Reservation_Store.select_auto if departure == None else Sqlite_Reservation_Store.select_auto_departure
+        else:
+            key = (username, vehicle_type, origin, destination, seat_type)
+            statement = Sqlite_Reservation_Store.select_vehicle if departure == None else Sqlite_Reservation_Store.select_vehicle_departure
+        if departure != None:
+            key += (departure.departure_id, )
+        row = self._db.execute(statement, key).fetchone()
+        return self.reservation(row) if row != None else None
+
+    def of_vehicle(self, vehicle:Vehicle) -> list:
+        return [self.reservation(row) for row in self._db.execute(Sqlite_Reservation_Store.select_departure, (vehicle.departure_id, ))]
+
+    def older_than(self, vehicle_type, age:int) -> list:
+        return [self.reservation(row) for row in self._db.execute(Sqlite_Reservation_Store.select_older, (vehicle_type, age))]
+
+    def user_age_changed(self, user:User, old_age:int):
+        # the age is one row, so nothing has to be reindexed.
+        self._db.execute(Sqlite_Reservation_Store.insert_user, (user.name, user.age))
+        self.changed()
+
+    def overbooked(self, vehicles:list) -> list:
+        victims:list = []
+        for vehicle in vehicles:
+            for key in vehicle.capacity.keys():
+                if vehicle.capacity[key] < 0:
+                    rows = self._db.execute(Sqlite_Reservation_Store.select_latest, (vehicle.departure_id, key, -vehicle.capacity[key]))
+                    victims.extend(self.reservation(row) for row in rows)
+        victims.sort(key=Railway_System.reservation_id_key, reverse=True)
+        return victims
+
+    def occupancy(self) -> dict:
+        return {departure_id: count for departure_id, count in self._db.execute(Sqlite_Reservation_Store.select_occupancy)}
+
+    def last(self) -> Reservation:
+        row = self._db.execute(Sqlite_Reservation_Store.select_last).fetchone()
+        return self.reservation(row) if row != None else None
+
+    def close(self):
+        self.commit()
+        self._db.close()
+
+
+class Seat_Capacity_Tree:
+    """
+    A max segment tree over the departures of a route for one seat type.
 
-    @property
-    def time(self):
-        return self._time
-    
-    @time.setter
-    def time(self, time:datetime):
-        self._time = time
+    Leaf i holds the free seats of the i-th departure (by dep_time), or -1 if that
+    departure doesn't have this seat type. first_at_least finds the earliest departure
+    from a position on with at least some free seats in O(log n).
+    """
+
+    def __init__(self, values:list):
+        self._size = 1
+        while self._size < len(values):
+            self._size *= 2
+        self._tree:list = [-1] * (2 * self._size)
+        self._tree[self._size:self._size + len(values)] = values
+        for i in range(self._size - 1, 0, -1):
+            self._tree[i] = max(self._tree[2 * i], self._tree[2 * i + 1])
+
+    def update(self, pos, value):
+        tree = self._tree
+        i = pos + self._size
+        tree[i] = value
+        i //= 2
+        while i >= 1:
+            tree[i] = max(tree[2 * i], tree[2 * i + 1])
+            i //= 2
+
+    def first_at_least(self, pos, threshold) -> int:
+        # the smallest leaf index >= pos with value >= threshold, -1 if there isn't any.
+        tree = self._tree
+        if pos >= self._size:
+            return -1
+        i = pos + self._size
+        if tree[i] >= threshold:
+            return pos
+        while i > 1:
+            if i % 2 == 0 and tree[i + 1] >= threshold:
+                i += 1
+                while i < self._size:
+                    i = 2 * i if tree[2 * i] >= threshold else 2 * i + 1
+                return i - self._size
+            i //= 2
+        return -1
+
+
+class Route_Departures:
+    """
+    The vehicles of one (origin, destination) route, kept sorted by dep_time.
+
+    dep_times and vehicles are parallel lists. Vehicles with the same dep_time stay
+    in the order they were added. For every seat type a Seat_Capacity_Tree is built
+    on demand and kept up to date by Vehicle.decrease_capacity / increase_capacity;
+    adding or removing a departure drops the trees so they are rebuilt on the next query.
+    """
+
+    def __init__(self):
+        self.dep_times:list = []
+        self.vehicles:list = []
+        self._seat_trees:dict = {}      # seat_type as key and a Seat_Capacity_Tree as value.
+        self._positions:dict = {}       # departure_id as key and its index in vehicles as value, valid while there are trees.
+
+    def __len__(self):
+        return len(self.vehicles)
+
+    def add(self, vehicle:Vehicle):
+        idx = bisect_right(self.dep_times, vehicle.dep_time)
+        self.dep_times.insert(idx, vehicle.dep_time)
+        self.vehicles.insert(idx, vehicle)
+        vehicle.route_indexes.append(self)
+        self._seat_trees = {}
+
+    def add_many(self, vehicles:list):
+        # adds vehicles in one sort, in the same order as adding them one by one would.
+        departures = list(zip(self.dep_times, self.vehicles)) + [(vehicle.dep_time, vehicle) for vehicle in vehicles]
+        departures.sort(key=Route_Departures.dep_time_key)
+        self.dep_times = [dep_time for dep_time, vehicle in departures]
+        self.vehicles = [vehicle for dep_time, vehicle in departures]
+        for vehicle in vehicles:
+            vehicle.route_indexes.append(self)
+        self._seat_trees = {}
+
+    @staticmethod
+    def dep_time_key(departure:tuple):
+        return departure[0]
+
+    def remove(self, vehicle:Vehicle):
+        idx = bisect_left(self.dep_times, vehicle.dep_time)
+        while self.vehicles[idx] is not vehicle:
+            idx += 1
+        del self.dep_times[idx]
+        del self.vehicles[idx]
+        vehicle.route_indexes.remove(self)
+        self._seat_trees = {}
+
+    def seat_tree(self, seat_type) -> Seat_Capacity_Tree:
+        if seat_type not in self._seat_trees:
+            if len(self._seat_trees) == 0:
+                self._positions = {vehicle.departure_id: idx for idx, vehicle in enumerate(self.vehicles)}
+            self._seat_trees[seat_type] = Seat_Capacity_Tree([Route_Departures.free_seats(vehicle, seat_type) for vehicle in self.vehicles])
+        return self._seat_trees[seat_type]
+
+    def capacity_changed(self, vehicle:Vehicle, seat_type):
+        if seat_type in self._seat_trees:
+            self._seat_trees[seat_type].update(self._positions[vehicle.departure_id], Route_Departures.free_seats(vehicle, seat_type))
+
+    def departure(self, dep_time:int) -> Vehicle:
+        idx = bisect_left(self.dep_times, dep_time)
+        if idx < len(self.vehicles) and self.dep_times[idx] == dep_time:
+            return self.vehicles[idx]
+        return None
+
+    def first_departure(self, time:int, seat_type) -> Vehicle:
+        # the earliest departure after time with free seats of seat_type.
+        # if all of them are full, the earliest one having seat_type is returned, and None if there isn't any.
+        idx = bisect_right(self.dep_times, time)
+        tree = self.seat_tree(seat_type)
+        pos = tree.first_at_least(idx, 1)
+        if pos == -1:
+            pos = tree.first_at_least(idx, 0)
+        if pos == -1:
+            return None
+        return self.vehicles[pos]
+
+    @staticmethod
+    def free_seats(vehicle:Vehicle, seat_type) -> int:
+        if seat_type not in vehicle.capacity:
+            return -1
+        return max(vehicle.capacity[seat_type], 0)
+
+
+class Timetable:
+    """
+    Stores every departure of the railway system.
+
+    A route can have any number of dated departures. They are indexed by route
+    (origin, destination), by vehicle (vehicle_type, origin, destination), by
+    vehicle_type and by service date (days since 1970/01/01), and every departure
+    gets a departure_id.
+    Adding a departure with the same vehicle, route and dep_time as an existing one replaces it.
+    """
+
+    def __init__(self):
+        self._departures:dict = {}      # departure_id as key.
+        self._routes:dict = {}          # (origin, destination) as key and a Route_Departures as value.
+        self._vehicle_routes:dict = {}  # (vehicle_type, origin, destination) as key and a Route_Departures as value.
+        self._service_dates:dict = {}   # date as key and a list of that day's departures as value.
+        self._vehicle_types:dict = {}   # vehicle_type as key and a departure_id keyed dict of its departures as value.
+        self._next_id:int = 0
+
+    def __len__(self):
+        return len(self._departures)
+
+    def __iter__(self):
+        return iter(self._departures.values())
+
+    def add(self, vehicle:Vehicle):
+        old_vehicle = self.departure(vehicle.vehicle_type, vehicle.origin, vehicle.destination, vehicle.dep_time)
+        if old_vehicle != None:
+            self.remove(old_vehicle)
+        vehicle.departure_id = self._next_id
+        self._next_id += 1
+        self._departures[vehicle.departure_id] = vehicle
+        self._routes.setdefault((vehicle.origin, vehicle.destination), Route_Departures()).add(vehicle)
+        self._vehicle_routes.setdefault((vehicle.vehicle_type, vehicle.origin, vehicle.destination), Route_Departures()).add(vehicle)
+        self._service_dates.setdefault(vehicle.dep_time // MINUTES_PER_DAY, []).append(vehicle)
+        self._vehicle_types.setdefault(vehicle.vehicle_type, {})[vehicle.departure_id] = vehicle
+
+    def add_many(self, vehicles:list):
+        """
+        Adds a batch of departures, building each route index once instead of once per vehicle.
+
+        The result is the same as adding them one by one: a departure replaces an existing one,
+        or an earlier one of the batch, with the same vehicle, route and dep_time.
+        """
+        batch:dict = {}
+        for vehicle in vehicles:
+            key = (vehicle.vehicle_type, vehicle.origin, vehicle.destination, vehicle.dep_time)
+            batch.pop(key, None)
+            batch[key] = vehicle
+        for key, vehicle in batch.items():
+            old_vehicle = self.departure(*key)
+            if old_vehicle != None:
+                self.remove(old_vehicle)
+            vehicle.departure_id = self._next_id
+            self._next_id += 1
+        self.index_departures(list(batch.values()))
+
+    def restore(self, vehicles:list, next_id:int):
+        # puts back departures which already have their departure_id (see Snapshot), in departure_id order.
+        self.index_departures(vehicles)
+        self._next_id = next_id
+
+    def index_departures(self, vehicles:list):
+        # adds vehicles with new departure_ids to every index, each route index sorted once.
+        routes:dict = {}
+        vehicle_routes:dict = {}
+        for vehicle in vehicles:
+            self._departures[vehicle.departure_id] = vehicle
+            routes.setdefault((vehicle.origin, vehicle.destination), []).append(vehicle)
+            vehicle_routes.setdefault((vehicle.vehicle_type, vehicle.origin, vehicle.destination), []).append(vehicle)
+            self._service_dates.setdefault(vehicle.dep_time // MINUTES_PER_DAY, []).append(vehicle)
+            self._vehicle_types.setdefault(vehicle.vehicle_type, {})[vehicle.departure_id] = vehicle
+        for index, new_routes in ((self._routes, routes), (self._vehicle_routes, vehicle_routes)):
+            for key, route_vehicles in new_routes.items():
+                index.setdefault(key, Route_Departures()).add_many(route_vehicles)
+
+    def remove(self, vehicle:Vehicle):
+        del self._departures[vehicle.departure_id]
+        for index, key in ((self._routes, (vehicle.origin, vehicle.destination)), (self._vehicle_routes, (vehicle.vehicle_type, vehicle.origin, vehicle.destination))):
+            index[key].remove(vehicle)
+            if len(index[key]) == 0:
+                del index[key]
+        self._service_dates[vehicle.dep_time // MINUTES_PER_DAY].remove(vehicle)
+        if len(self._service_dates[vehicle.dep_time // MINUTES_PER_DAY]) == 0:
+            del self._service_dates[vehicle.dep_time // MINUTES_PER_DAY]
+        del self._vehicle_types[vehicle.vehicle_type][vehicle.departure_id]
+        if len(self._vehicle_types[vehicle.vehicle_type]) == 0:
+            del self._vehicle_types[vehicle.vehicle_type]
+
+    def get(self, departure_id:int) -> Vehicle:
+        return self._departures.get(departure_id)
+
+    def route(self, origin, destination) -> Route_Departures:
+        return self._routes.get((origin, destination))
+
+    def vehicle_route(self, vehicle_type, origin, destination) -> Route_Departures:
+        return self._vehicle_routes.get((vehicle_type, origin, destination))
+
+    def departure(self, vehicle_type, origin, destination, dep_time:int) -> Vehicle:
+        departures = self.vehicle_route(vehicle_type, origin, destination)
+        if departures == None:
+            return None
+        return departures.departure(dep_time)
+
+    def of_type(self, vehicle_type) -> list:
+        return list(self._vehicle_types.get(vehicle_type, {}).values())
+
+    def departures_on(self, service_date) -> list:
+        return list(self._service_dates.get(service_date, []))
+
+
+# the columns Railway_System.import_timetable needs, vip1, vip2, ... are optional.
+timetable_columns = ("vehicle_type", "origin", "destination", "dep_time", "capacity")
+
+
+def read_timetable_csv(path:str) -> dict:
+    # reads a timetable CSV with a header row into a dict of columns for Railway_System.import_timetable.
+    with open(path, newline='') as csv_file:
+        reader = csv.reader(csv_file)
+        names = [name.strip() for name in next(reader)]
+        columns:dict = {name: [] for name in names}
+        for cells in reader:
+            if len(cells) == 0:
+                continue
+            # short rows are padded, so a vehicle with fewer VIP classes can leave them out.
+            cells = cells + [''] * (len(names) - len(cells))
+            for name, cell in zip(names, cells):
+                columns[name].append(cell)
+    return columns
+
+
+class Result_Sink(ABC):
+    """
+    Where Railway_System writes its results, one message per decision.
+
+    An abstract base: a sink implements write(message, event, index), which gets the message
+    as it would be printed, the kind of the command that made it (or "vehicles" for the
+    Done / Error line) and the command index. Writes may be buffered until flush, which
+    does nothing unless a sink overrides it.
+    """
+
+    @abstractmethod
+    def write(self, message:str, event:str = None, index:int = None):
+        pass
+
+    def flush(self):
+        pass
+
+
+class Text_Sink(Result_Sink):
+    """
+    Writes the messages as lines of text, the same bytes print() wrote, but in blocks of
+    about buffer_size characters instead of one write per message.
+    """
+
+    def __init__(self, stream = None, buffer_size:int = 1 << 16):
+        self.stream = stream
+        self.buffer_size = buffer_size
+        self._buffer:list = []
+        self._buffered = 0
+
+    def write(self, message:str, event:str = None, index:int = None):
+        self._buffer.append(message)
+        self._buffer.append('\n')
+        self._buffered += len(message) + 1
+        if self._buffered >= self.buffer_size:
+            self.flush()
+
+    def flush(self):
+        # sys.stdout is looked up here, so a sink made before it is redirected still follows it.
+        stream = self.stream if self.stream != None else sys.stdout
+        if len(self._buffer) != 0:
+            stream.write(''.join(self._buffer))
+            self._buffer = []
+            self._buffered = 0
+        stream.flush()
+
+
+class Json_Lines_Sink(Text_Sink):
+    """
+    Writes one JSON object per message: {"index": ..., "event": ..., "message": ...}.
+    """
+
+    def write(self, message:str, event:str = None, index:int = None):
+        Text_Sink.write(self, json.dumps({"index": index, "event": event, "message": message}))
+
+
+class Result_Collector(Result_Sink):
+    """
+    Keeps the results in memory as (message, event, index) tuples, for tests and for
+    Railway_System.print_result.
+    """
+
+    def __init__(self):
+        self.results:list = []
+
+    def write(self, message:str, event:str = None, index:int = None):
+        self.results.append((message, event, index))
 
-    @property
-    def seat_type(self):
-        return self._seat_type
-    
-    @seat_type.setter
-    def seat_type(self, seat_type):
-        self._seat_type = seat_type
 
 class Railway_System:
     """
     A class representing a railway system.
 
     Attributes:
-    - vehicles (OrderedDict): A dictionary that stores vehicle objects with their origin and destination as keys.
+    - vehicles (Timetable): Stores the departures, indexed by route, by vehicle and by service date.
     - users (OrderedDict): A dictionary that stores user objects with their id as keys.
-    - reservations (list): A list that stores reservation objects made by users.
+    - reservations (Reservation_Store): An insertion-ordered store of reservation objects made by users, indexed for which_reservation.
+      Railway_System(storage="columnar") uses a Columnar_Reservation_Store instead, which needs numpy,
+      and storage="sqlite" a Sqlite_Reservation_Store; storage_options are given to the store's constructor
+      (e.g. {"path": "reservations.db", "batch_size": 1000}).
+    - sink (Result_Sink): Gets the result messages, a buffered Text_Sink on stdout unless another one is given.
 
     Methods:
     - add_vehicle(vehicle): Adds a vehicle object to the vehicles dictionary.
     - add_user(user): Adds a user object to the users dictionary.
     - book(reservation): Appends a reservation object to the reservations list.
+    - execute(command): Runs a command of parse_command through the handlers table.
+    - fork(): A Railway_Fork for trying rules on the current state without changing it.
     """
 
-    one_hour = timedelta(hours= 1)
-    thirty_days = timedelta(days= 30)
+    one_hour = 60
+    one_day = MINUTES_PER_DAY
+    thirty_days = 30 * MINUTES_PER_DAY
 
-    def __init__(self):
-        self._vehicles = OrderedDict()
+    storages = {"objects": Reservation_Store, "columnar": Columnar_Reservation_Store, "sqlite": Sqlite_Reservation_Store}
+
+    def __init__(self, storage:str = "objects", sink:Result_Sink = None, storage_options:dict = None):
+        if storage not in Railway_System.storages:
+            raise ValueError("unknown storage: " + storage)
+        self._vehicles = Timetable()
         self._users = OrderedDict()
-        self._reservations = []
-        self._results = []
+        self._reservations = Railway_System.storages[storage](**(storage_options if storage_options != None else {}))
+        if len(self._reservations) != 0:
+            # its users and departures aren't here.
+            raise ValueError("the " + storage + " store already has reservations of another run")
+        self._reservations.bind(self._users, self._vehicles)
+        self.set_sink(sink if sink != None else Text_Sink())
+        self._command = None
+        self._mutation:str = None       # what the command being executed changed, for the journal.
+        self.journal = None             # a Journal, see Journal.attach.
+        self._held:list = None          # results of the command being executed, for the journal.
+        self.restored = False           # True if the state came from a Snapshot, its vehicles are loaded already.
+        self.watermark:tuple = None     # the (time, index) of the last command executed.
+        self.index_base = 0             # added by run_command to the index of every command, see continue_input.
+        self.forks:list = []            # the open Railway_Forks of this system, see fork.
         self.rule_idx = 0
         self.train_reserve_count_limit = 10000
         self.airplane_reserve_count_limit = 10000
@@ -270,32 +1154,125 @@ class Railway_System:
             vehicle_type, origin, destination, dep_time, capacity, vip_seats_count, vip_seats_list = cmd
             vip_seats_list = vip_seats_list.split()
         
-        # definition of vip_seats_dict down here, the 0 key shows the count of normal seats. other keys are the type o seat and their value is their capacity.
-        vip_seats_dict = OrderedDict()
-        vip_seats_dict['0'] = int(capacity)
-        for i in range(1, int(vip_seats_count) + 1):
-            vip_seats_dict[str(i)] = int(vip_seats_list[i - 1])
-        self._vehicles[cmd[0] + ' ' + cmd[1] + ' ' + cmd[2]] = Vehicle(vehicle_type=vehicle_type, origin=origin, destination=destination, dep_time=datetime.strptime(dep_time, "%Y/%m/%d-%H:%M") , capacity=vip_seats_dict)
+        # definition of seat_counts down here, seat type 0 is the count of normal seats. other seat types are VIP and their value is their capacity.
+        seat_counts = Seat_Counts([int(capacity)] + [int(vip_seats_list[i - 1]) for i in range(1, int(vip_seats_count) + 1)])
+        self._vehicles.add(Vehicle(vehicle_type=symbols.intern(vehicle_type), origin=symbols.intern(origin), destination=symbols.intern(destination), dep_time=parse_time(dep_time) , capacity=seat_counts))
+
+    def import_timetable(self, columns) -> list:
+        """
+        Adds many departures at once.
+
+        columns maps column names to equally long sequences: vehicle_type, origin, destination,
+        dep_time ("%Y/%m/%d-%H:%M"), capacity and optionally vip1, vip2, ... for the capacity of
+        each VIP class, empty when a vehicle has fewer classes. A dict of lists, the output of
+        read_timetable_csv or a numpy .npz file all work.
+
+        Every row is checked before anything is added, and only the valid rows are added, in one
+        Timetable.add_many. Returns the bad rows as (row, message) tuples, rows counted from 0.
+        """
+        for name in timetable_columns:
+            if name not in columns:
+                raise ValueError("the timetable has no " + name + " column")
+        vip_names = sorted([name for name in columns if name.startswith("vip") and name[3:].isdigit()], key=lambda name: int(name[3:]))
+        # each column is read once, as strings.
+        table = {name: [str(cell).strip() for cell in columns[name]] for name in list(timetable_columns) + vip_names}
+        row_count = len(table["vehicle_type"])
+        bad_rows:dict = {}
+        for name in table:
+            if len(table[name]) != row_count:
+                raise ValueError("the " + name + " column has " + str(len(table[name])) + " rows, not " + str(row_count))
+
+        for name in ("vehicle_type", "origin", "destination"):
+            for row, cell in enumerate(table[name]):
+                if cell == '' and row not in bad_rows:
+                    bad_rows[row] = "no " + name
+        dep_times:list = []
+        for row, cell in enumerate(table["dep_time"]):
+            try:
+                dep_times.append(parse_time(cell))
+            except ValueError:
+                dep_times.append(None)
+                bad_rows.setdefault(row, "bad dep_time " + repr(cell))
+        for row, cell in enumerate(table["capacity"]):
+            if not cell.isdigit():
+                bad_rows.setdefault(row, "bad capacity " + repr(cell))
+        vip_rows = list(zip(*[table[name] for name in vip_names])) if len(vip_names) != 0 else [()] * row_count
+        for row, cells in enumerate(vip_rows):
+            classes = len(cells)
+            while classes != 0 and cells[classes - 1] == '':
+                classes -= 1
+            if not all(cell.isdigit() for cell in cells[:classes]):
+                bad_rows.setdefault(row, "bad VIP capacities " + repr(cells[:classes]))
+
+        vehicles:list = []
+        for row in range(row_count):
+            if row in bad_rows:
+                continue
+            vip_cells = [cell for cell in vip_rows[row] if cell != '']
+            seat_counts = Seat_Counts([int(table["capacity"][row])] + [int(cell) for cell in vip_cells])
+            vehicles.append(Vehicle(vehicle_type=symbols.intern(table["vehicle_type"][row]), origin=symbols.intern(table["origin"][row]), destination=symbols.intern(table["destination"][row]), dep_time=dep_times[row], capacity=seat_counts))
+        self._vehicles.add_many(vehicles)
+        return sorted(bad_rows.items())
+
+    def save_snapshot(self, path:str):
+        Snapshot(self).save(path)
+
+    @staticmethod
+    def from_snapshot(path:str, storage:str = "objects", sink:Result_Sink = None, storage_options:dict = None):
+        # a Railway_System in the state a save_snapshot left it, see Snapshot.
+        return Snapshot.restore(path, storage, sink, storage_options)
+
+    def continue_input(self):
+        # a new input after a restored state: its indexes start at 0 again, so they are numbered
+        # on from the watermark's, and a command in the same minute as the last applied one runs
+        # after it instead of being stale.
+        self.index_base = self.watermark[1] + 1 if self.watermark != None else 0
+
+    def fork(self, sink:Result_Sink = None):
+        # a copy-on-write view of the current state for what-if rules, see Railway_Fork.
+        return Railway_Fork(self, sink)
+
+    def copy_on_write(self, vehicle:Vehicle = None, reservation:Reservation = None, user:User = None):
+        # called before the vehicle's seats or limits, the user's age or the reservation change,
+        # so that every open fork keeps the state it was made from.
+        for fork in self.forks:
+            fork.preserve(vehicle, reservation, user)
 
     def add_user(self, username):
         self._users[username] = User(username)
 
-    def which_reservation(self, username, vehicle, origin, destination, seat_type) -> Reservation:
-        for reservation in self._reservations:
-            if (reservation.vehicle.vehicle_type == vehicle and reservation.vehicle.origin == origin and reservation.vehicle.destination == destination and reservation.user.name == username and reservation.seat_type == seat_type) or (vehicle == "Auto" and reservation.vehicle.origin == origin and reservation.vehicle.destination == destination and reservation.user.name == username and reservation.seat_type == seat_type):
-                return reservation
-        return None
+    def occupancy_per_route(self) -> dict:
+        # (origin, destination) as key and the count of live reservations on that route as value.
+        counts:dict = {}
+        for departure_id, count in self._reservations.occupancy().items():
+            vehicle:Vehicle = self._vehicles.get(departure_id)
+            counts[(vehicle.origin, vehicle.destination)] = counts.get((vehicle.origin, vehicle.destination), 0) + count
+        return counts
+
+    def last_reservation_time(self, the_vehicle:Vehicle) -> int:
+        # time of the latest live reservation, or of the vehicle's last one if every reservation is cancelled.
+        last_reservation:Reservation = self._reservations.last()
+        if last_reservation == None:
+            return the_vehicle.last_reservation
+        return last_reservation.time
+
+    def which_reservation(self, username, vehicle, origin, destination, seat_type, departure:Vehicle = None) -> Reservation:
+        return self._reservations.find(username, vehicle, origin, destination, seat_type, departure)
+
+    def which_departure(self, vehicle, origin, destination, dep_time:int) -> Vehicle:
+        # finds a specific departure, addressed as "Train@2023/05/01-10:00" in commands.
+        return self._vehicles.departure(symbols.capitalized(vehicle), symbols.capitalized(origin), symbols.capitalized(destination), dep_time)
             
     def is_there_same_cancelation(self, username, origin, destination, cancelation_time, command_list) -> bool:
-        for cmd in command_list:
-            if cmd[1] == username and cmd[2] == origin and cmd[3] == destination and datetime.strptime(cmd[0], "%Y/%m/%d-%H:%M") < cancelation_time:
+        # command_list is a list of Command_Record.
+        for record in command_list:
+            if record.user == username and record.origin == origin and record.destination == destination and record.time < cancelation_time:
                 return True
         return False
     
-    def decision_maker(self, reserve_time:datetime, origin, destination, seat_type, username) -> Vehicle:
-        tmp_vehcile_dep_time:datetime = None
-        suitable_vehicles:list = []
-        if (("Train" + ' ' + origin + ' ' + destination) not in self._vehicles.keys()) and (("Airplane" + ' ' + origin + ' ' + destination) not in self._vehicles.keys()):
+    def decision_maker(self, reserve_time:int, origin, destination, seat_type, username) -> Vehicle:
+        route:Route_Departures = self._vehicles.route(origin, destination)
+        if route == None:
             return "Na Movafagh. Masir vojood nadarad."
         if (username not in self._users.keys()) and seat_type != '0':
             return "Na Movafagh. Shoma reserve qabli nadarid va nemitavanid VIP reserve konid."
@@ -305,41 +1282,27 @@ class Railway_System:
             if self._users[username].reservation_date_record[-1]  + Railway_System.thirty_days < reserve_time:
                 return "Na Movafagh. Shoma reserve qabli nadarid va nemitavanid VIP reserve konid."
 
-        for vehicle in self._vehicles.values():
-            if vehicle.dep_time > reserve_time and vehicle.origin == origin and vehicle.destination == destination and (seat_type in vehicle.capacity.keys()):
-                suitable_vehicles.append(vehicle)
-
-        suitable_vehicles = sorted(suitable_vehicles, key=Railway_System.dep_time_key)
-
-        for vehicle in suitable_vehicles:
-            if vehicle.capacity[seat_type] != 0:
-                return vehicle.vehicle_type
-        if len(suitable_vehicles) == 0:
+        # the route's departures are already sorted by dep_time, so the first one with free seats is the answer.
+        vehicle = route.first_departure(reserve_time, seat_type)
+        if vehicle == None:
             return None
-        else:
-            return "Na Movafagh. Zarfiat vojood nadarad."
+        if vehicle.capacity[seat_type] > 0:
+            return vehicle
+        return "Na Movafagh. Zarfiat vojood nadarad."
 
 
-    def book(self, cmd):
+    def book(self, command):
+        # a rejected booking is journaled too, it can still change the user, the counters and the queues.
+        self._mutation = "book_rejected"
         # getting input:
-        if len(cmd) == 6:
-            reserve_time_str, username, origin, destination, age, print_id = cmd
-            seat_type = '0'
-            vehicle = "Auto"
-        elif len(cmd) == 7:
-            if cmd[4].isdigit():
-                reserve_time_str, username, origin, destination, age, seat_type, print_id = cmd
-                vehicle = "Auto"
-            else:
-                reserve_time_str, username, origin, destination, vehicle, age, print_id = cmd
-                seat_type = '0'
-        else:
-            reserve_time_str, username, origin, destination, vehicle, age, seat_type, print_id = cmd
-        reserve_time = datetime.strptime(reserve_time_str, "%Y/%m/%d-%H:%M")
+        reserve_time, username, origin, destination, vehicle, age, seat_type = command.time, command.user, command.origin, command.destination, command.vehicle, command.age, command.seat_type
+        the_vehicle:Vehicle = None
         if vehicle == "Auto":
             vehicle = self.decision_maker(reserve_time, origin, destination, seat_type, username)
+            if isinstance(vehicle, Vehicle):
+                the_vehicle = vehicle
+                vehicle = the_vehicle.vehicle_type
         queued_request:Reservation = 0
-        age:int = int(age)
         reservation_validity = "Movafagh"
         if vehicle == None:
             reservation_validity = "Na Movafagh. Masir vojood nadarad."
@@ -347,27 +1310,34 @@ class Railway_System:
             reservation_validity = vehicle
         elif vehicle == "Na Movafagh. Shoma reserve qabli nadarid va nemitavanid VIP reserve konid.":
             reservation_validity = vehicle
-        else:
-            vehicle_name = vehicle + ' ' + origin + ' ' + destination
 
         
         # add user if not in users:
         if username not in self._users.keys():
             self._users[username] = User(username, age)
-        else:
+        elif self._users[username].age != age:
+            old_age = self._users[username].age
+            self.copy_on_write(user=self._users[username])
             self._users[username].age = age
+            self._reservations.user_age_changed(self._users[username], old_age)
         the_user:User = self._users[username]
 
         # checking if is there such a vehicle:
-        if reservation_validity == "Movafagh":
-            if (vehicle_name not in self._vehicles.keys()) and (Railway_System.capitalize_first_letter(vehicle_name) not in self._vehicles.keys()):
-                reservation_validity = "Na Movafagh. Masir vojood nadarad."
+        if reservation_validity == "Movafagh" and the_vehicle == None:
+            if command.departure != None:
+                the_vehicle = self.which_departure(vehicle, origin, destination, command.departure)
             else:
-                the_vehicle:Vehicle = self._vehicles[Railway_System.capitalize_first_letter(vehicle_name)]
+                departures:Route_Departures = self._vehicles.vehicle_route(symbols.capitalized(vehicle), symbols.capitalized(origin), symbols.capitalized(destination))
+                if departures != None:
+                    the_vehicle = departures.first_departure(reserve_time, seat_type)
+                    if the_vehicle == None:
+                        the_vehicle = departures.vehicles[-1]       # every departure is gone, the dep_time check below rejects it.
+            if the_vehicle == None:
+                reservation_validity = "Na Movafagh. Masir vojood nadarad."
 
         # checking time limits
         if reservation_validity == "Movafagh":
-            reserve_clock = time(hour=int(reserve_time_str[-5:-3]), minute=int(reserve_time_str[-2:]))
+            reserve_clock = reserve_time % MINUTES_PER_DAY
             if the_vehicle.time_limit:
                 if reserve_clock < the_vehicle.end_time and reserve_clock > the_vehicle.start_time:
                     reservation_validity = "Na Movafagh. Emkan reserve vojood nadarad."
@@ -396,16 +1366,21 @@ class Railway_System:
 
         # checking if is there cancelation request in list or not:
         if reservation_validity == "Movafagh" and seat_type != '0':
-            if len(the_vehicle.cancelation_request) != 0:
-                queued_request:Reservation = the_vehicle.cancelation_request[0]
-                the_vehicle.pop_cancelation_request(queued_request)
+            queued_request = the_vehicle.pop_cancelation_request(seat_type)
+            if queued_request == None:
+                queued_request = 0
+            else:
+                self.copy_on_write(the_vehicle, queued_request)
                 self._reservations.remove(queued_request)
                 the_vehicle.increase_capacity(seat_type=seat_type)
                 queued_request.user.last_cancelation = reserve_time
 
         # checking capacity
         if reservation_validity == "Movafagh":
-            if the_vehicle.capacity[seat_type] <= 0:
+            if seat_type not in the_vehicle.capacity:
+                # the vehicle has no such seat type, the answer decision_maker gives for "Auto".
+                reservation_validity = "Na Movafagh. Masir vojood nadarad."
+            elif the_vehicle.capacity[seat_type] <= 0:
                 reservation_validity = "Na Movafagh. Zarfiat vojood nadarad."
 
         # time per period operation for week
@@ -423,11 +1398,7 @@ class Railway_System:
                 if self.train_active_limit:
                     if the_vehicle.last_reservation != None:
                         if the_vehicle.reservation_step == "rooz":
-                            avail_time = self._reservations[-1].time + timedelta(days=1)
-                            avail_time_str = datetime.strftime(avail_time, "%Y/%m/%d-%H:%M")
-                            avail_time_str = avail_time_str[:10]
-                            avail_time_str += "-00:00"
-                            avail_time = datetime.strptime(avail_time_str, "%Y/%m/%d-%H:%M")
+                            avail_time = day_start(self.last_reservation_time(the_vehicle) + Railway_System.one_day)
                             if avail_time < reserve_time:
                                 if the_vehicle.vehicle_type == "Train":
                                     self.train_reserves_in_this_period = 0
@@ -441,11 +1412,7 @@ class Railway_System:
                                     reservation_validity = "Na Movafagh. Emkan reserve vojood nadarad."
 
                         else:
-                            avail_time = the_vehicle.last_reservation + timedelta(days=30)
-                            avail_time_str = datetime.strftime(avail_time, "%Y/%m/%d-%H:%M")
-                            avail_time_str = avail_time_str[:7]
-                            avail_time_str += "/00-00:00"
-                            avail_time = datetime.strptime(avail_time_str, "%Y/%m/%d-%H:%M")
+                            avail_time = month_start(the_vehicle.last_reservation + Railway_System.thirty_days)
                             if avail_time < reserve_time:
                                 the_vehicle.reserves_in_this_step = 0
                             if self.train_reserves_in_this_period >= self.train_active_limit:
@@ -454,11 +1421,7 @@ class Railway_System:
                 if self.airplane_active_limit:
                     if the_vehicle.last_reservation != None:
                         if the_vehicle.reservation_step == "rooz":
-                            avail_time = self._reservations[-1].time + timedelta(days=1)
-                            avail_time_str = datetime.strftime(avail_time, "%Y/%m/%d-%H:%M")
-                            avail_time_str = avail_time_str[:10]
-                            avail_time_str += "-00:00"
-                            avail_time = datetime.strptime(avail_time_str, "%Y/%m/%d-%H:%M")
+                            avail_time = day_start(self.last_reservation_time(the_vehicle) + Railway_System.one_day)
                             if avail_time < reserve_time:
                                 if the_vehicle.vehicle_type == "Train":
                                     self.train_reserves_in_this_period = 0
@@ -472,11 +1435,7 @@ class Railway_System:
                                     reservation_validity = "Na Movafagh. Emkan reserve vojood nadarad."
 
                         else:
-                            avail_time = self._reservations[-1].time + timedelta(days=30)
-                            avail_time_str = datetime.strftime(avail_time, "%Y/%m/%d-%H:%M")
-                            avail_time_str = avail_time_str[:7]
-                            avail_time_str += "/01-00:00"
-                            avail_time = datetime.strptime(avail_time_str, "%Y/%m/%d-%H:%M")
+                            avail_time = month_start(self.last_reservation_time(the_vehicle) + Railway_System.thirty_days)
                             if avail_time < reserve_time:
                                 self.airplane_reserves_in_this_period = 0
                             if self.airplane_reserves_in_this_period >= self.airplane_active_limit:
@@ -486,7 +1445,9 @@ class Railway_System:
 
         # fianl action:
         if reservation_validity == "Movafagh":
-            self._reservations.append(Reservation(user=the_user, vehicle=the_vehicle, time=reserve_time, seat_type=seat_type))
+            self._mutation = "book"
+            self.copy_on_write(the_vehicle)
+            self._reservations.add(Reservation(user=the_user, vehicle=the_vehicle, time=reserve_time, seat_type=seat_type))
             the_user.add_reservation_record(reserve_time)
             the_vehicle.decrease_capacity(seat_type=seat_type)
             the_vehicle.reserves_in_this_step += 1
@@ -501,40 +1462,29 @@ class Railway_System:
             else:
                 seat_type_text = "VIP" + seat_type
             if queued_request != 0:
-                print("Reserve karbar " + username + " baraye belit " + vehicle.lower() + " model " + seat_type_text + " movafagh bood. Hamchenin Reserve karbar " + queued_request.user.name + " baraye in belit cancel shod.")
+                self.result("Reserve karbar " + username + " baraye belit " + symbols.lower(vehicle) + " model " + seat_type_text + " movafagh bood. Hamchenin Reserve karbar " + queued_request.user.name + " baraye in belit cancel shod.")
             else:
-                print("Reserve karbar " + username + " baraye belit " + vehicle.lower() + " model " + seat_type_text + " movafagh bood.")
+                self.result("Reserve karbar " + username + " baraye belit " + symbols.lower(vehicle) + " model " + seat_type_text + " movafagh bood.")
 
         else:
-            print(reservation_validity)
+            self.result(reservation_validity)
             
-    def cancel_reservation(self, cmd, command_list):
-        if len(cmd) == 6:
-            cancelation_time_str, username, origin, destination, cancel_shit_word, print_id = cmd
-            vehicle = "Auto"
-            seat_type = '0'
-        elif len(cmd) == 7:
-            if cmd[-3].isdigit():
-                cancelation_time_str, username, origin, destination, vehicle_or_seat_type, cancel_shit_word, print_id = cmd
-                seat_type = vehicle_or_seat_type
-                vehicle = "Auto"
-            else:
-                cancelation_time_str, username, origin, destination, vehicle_or_seat_type, cancel_shit_word, print_id = cmd
-                vehicle = vehicle_or_seat_type
-                seat_type = '0'
-        else:
-            cancelation_time_str, username, origin, destination, vehicle, seat_type, cancel_shit_word, print_id = cmd
-        cancelation_time = datetime.strptime(cancelation_time_str, "%Y/%m/%d-%H:%M")
-        vehicle_name = vehicle + ' ' + origin + ' ' + destination
-        vehicle_name = Railway_System.capitalize_first_letter(vehicle_name)
+    def cancel_reservation(self, command):
+        cancelation_time, username, origin, destination, vehicle, seat_type = command.time, command.user, command.origin, command.destination, command.vehicle, command.seat_type
         cancelation_validity = "Movafagh"
         
         # checking whether the reservation exist or not:
-        the_reservation:Reservation = self.which_reservation(username, Railway_System.capitalize_first_letter(vehicle), origin, destination, seat_type)
+        if command.departure != None:
+            departure:Vehicle = self.which_departure(vehicle, origin, destination, command.departure)
+            the_reservation:Reservation = None
+            if departure != None:
+                the_reservation = self.which_reservation(username, symbols.capitalized(vehicle), origin, destination, seat_type, departure)
+        else:
+            the_reservation:Reservation = self.which_reservation(username, symbols.capitalized(vehicle), origin, destination, seat_type)
         if the_reservation == None:
             cancelation_validity = "Na Movafagh. Reserve vojood nadarad."
         else:
-            the_vehicle:Vehicle = self._vehicles[vehicle_name]
+            the_vehicle:Vehicle = the_reservation.vehicle
             the_user:User = self._users[username]
 
         # checking if vehicle is gone or not:
@@ -544,7 +1494,7 @@ class Railway_System:
 
         # checking if is such reservation in vehicle cancelation list:
         if cancelation_validity == "Movafagh":
-            if (the_reservation in the_vehicle.cancelation_request):
+            if the_vehicle.is_cancelation_in_list(the_reservation):
                 cancelation_validity = "Na Movafagh. Darkhast cancel shoma qablan sabt shode ast."
 
         # checking last cancelation
@@ -557,97 +1507,106 @@ class Railway_System:
         # the fianl part:
         if cancelation_validity == "Movafagh":
             if the_reservation.seat_type == '0':
+                self._mutation = "cancel"
+                self.copy_on_write(the_vehicle, the_reservation)
                 self._reservations.remove(the_reservation)
                 the_vehicle.increase_capacity(the_reservation.seat_type)
                 the_user.last_cancelation = cancelation_time
                 the_user.remove_from_reservation_record(the_reservation.time)
-                print("Reserve karbar " + the_user.name + " baraye " + vehicle.lower() + " ba movafaghiat cancel shod.")
+                self.result("Reserve karbar " + the_user.name + " baraye " + symbols.lower(the_vehicle.vehicle_type) + " ba movafaghiat cancel shod.")
             else:
-                the_vehicle.cancelation_request.append(the_reservation)
-                print("Darkhast cancel reserve karbar " + the_user.name + " baraye belit " + vehicle.lower() + " VIP" + the_reservation.seat_type + " sabt shod.")
+                self._mutation = "queued_cancel"
+                the_vehicle.add_cancelation_request(the_reservation)
+                self.result("Darkhast cancel reserve karbar " + the_user.name + " baraye belit " + symbols.lower(the_vehicle.vehicle_type) + " VIP" + the_reservation.seat_type + " sabt shod.")
         else:
-            print(cancelation_validity)
+            self.result(cancelation_validity)
 
-    def cut_the_capacity(self, cmd):
+    def cut_the_capacity(self, rule):
         self.rule_idx += 1
-        print("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
-        vehicle_type = Railway_System.capitalize_first_letter(cmd[4])
-        unavailable_percentage = 1 - (int(cmd[6]) / 100)
+        self._mutation = "rule"
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+        vehicle_type = symbols.capitalized(rule.vehicle_type)
+        unavailable_percentage = 1 - (rule.percent / 100)
         
         # changes primary capacity
-        for vehicle in self._vehicles.values():
-            if vehicle.vehicle_type == vehicle_type:
-                for key in vehicle.capacity.keys():
-                    vehicle.primary_capacity[key] = vehicle.primary_capacity[key] - int(unavailable_percentage * vehicle.const_primary_capacity[key])
-                    vehicle.capacity[key] = vehicle.capacity[key] - int(unavailable_percentage * vehicle.const_primary_capacity[key])
-
-        # sacks passengers
-        for reserve in reversed(self._reservations):
-            if reserve.vehicle.vehicle_type == vehicle_type:
-                if reserve.vehicle.capacity[reserve.seat_type] < 0:
-                    reserve.vehicle.capacity[reserve.seat_type] += 1
-                    self._reservations.remove(reserve)
-                    if reserve.seat_type == '0':
-                        print("Reserve karbar " + reserve.user.name + " baraye " + reserve.vehicle.vehicle_type.lower() + " model Normal be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
-                    else:
-                        print("Reserve karbar " + reserve.user.name + " baraye " + reserve.vehicle.vehicle_type.lower() + " model VIP" + reserve.seat_type + " be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+        vehicles:list = self._vehicles.of_type(vehicle_type)
+        for vehicle in vehicles:
+            self.copy_on_write(vehicle)
+            for key in vehicle.capacity.keys():
+                vehicle.primary_capacity[key] = vehicle.primary_capacity[key] - int(unavailable_percentage * vehicle.const_primary_capacity[key])
+                vehicle.decrease_capacity(key, int(unavailable_percentage * vehicle.const_primary_capacity[key]))
+
+        # sacks passengers, latest reservation first
+        for reserve in self._reservations.overbooked(vehicles):
+            self.copy_on_write(reservation=reserve)
+            reserve.vehicle.increase_capacity(reserve.seat_type)
+            reserve.vehicle.discard_cancelation_request(reserve)
+            self._reservations.remove(reserve)
+            if reserve.seat_type == '0':
+                self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model Normal be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+            else:
+                self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model VIP" + reserve.seat_type + " be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
 
 
 
 
-    def apply_age_limits(self, cmd):
+    def apply_age_limits(self, rule):
         self.rule_idx += 1
-        print("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
-        vehicle_type = Railway_System.capitalize_first_letter(cmd[2])
-        age_limitation = int(cmd[6])
+        self._mutation = "rule"
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+        vehicle_type = symbols.capitalized(rule.vehicle_type)
+        age_limitation = rule.age
         vehicle:Vehicle = None
         reserve:Reservation = None
-        for vehicle in self._vehicles.values():
-            if vehicle.vehicle_type == vehicle_type:
-                vehicle.age_limitation = age_limitation
-
-        for reserve in self._reservations:
-            if reserve.vehicle.vehicle_type == vehicle_type:
-                if reserve.user.age > reserve.vehicle.age_limitation:
-                    reserve.vehicle.capacity[reserve.seat_type] += 1
-                    self._reservations.remove(reserve)
-                    if reserve.seat_type == '0':
-                        print("Reserve karbar " + reserve.user.name + " baraye " + reserve.vehicle.vehicle_type.lower() + " model Normal be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
-                    else:
-                        print("Reserve karbar " + reserve.user.name + " baraye " + reserve.vehicle.vehicle_type.lower() + " model VIP" + reserve.seat_type + " be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
-
-    def apply_time_limit(self, cmd):
+        for vehicle in self._vehicles.of_type(vehicle_type):
+            self.copy_on_write(vehicle)
+            vehicle.age_limitation = age_limitation
+
+        # sacks passengers in the order they reserved
+        for reserve in self._reservations.older_than(vehicle_type, age_limitation):
+            self.copy_on_write(reservation=reserve)
+            reserve.vehicle.increase_capacity(reserve.seat_type)
+            reserve.vehicle.discard_cancelation_request(reserve)
+            self._reservations.remove(reserve)
+            if reserve.seat_type == '0':
+                self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model Normal be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+            else:
+                self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model VIP" + reserve.seat_type + " be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+
+    def apply_time_limit(self, rule):
         self.rule_idx += 1
-        print("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
-        vehicle_type = Railway_System.capitalize_first_letter(cmd[2])
-        for vehicle in self._vehicles.values():
-            if vehicle.vehicle_type == vehicle_type:
-                vehicle.time_limit = True
-                vehicle.start_time = time(hour=int(cmd[5]))
-                vehicle.end_time = time(hour=int(cmd[7]))
-
-    def apply_reserves_count_for_week(self, cmd):
+        self._mutation = "rule"
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+        vehicle_type = symbols.capitalized(rule.vehicle_type)
+        for vehicle in self._vehicles.of_type(vehicle_type):
+            vehicle.time_limit = True
+            vehicle.start_time = rule.start_hour * 60
+            vehicle.end_time = rule.end_hour * 60
+
+    def apply_reserves_count_for_week(self, rule):
         self.rule_idx += 1
-        print("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
-        vehicle_type = Railway_System.capitalize_first_letter(cmd[4])
-        times_per_step = int(cmd[7])
-        time_step = timedelta(days=7)
+        self._mutation = "rule"
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+        vehicle_type = symbols.capitalized(rule.vehicle_type)
+        times_per_step = rule.count
+        time_step = 7 * MINUTES_PER_DAY
         
         # activating rule
         # vehicle:Vehicle = None
-        # for vehicle in self._vehicles.values():
+        # for vehicle in self._vehicles:
         #     if vehicle.vehicle_type == vehicle_type:
         #         vehicle.active_times_limitation = True
         #         vehicle.reservation_step = time_step
         #         vehicle.reserve_limit = times_per_step
                 # vehicle.reserves_in_this_step = times_per_step
 
-    def apply_reserves_count_for_else(self, cmd):
+    def apply_reserves_count_for_else(self, rule):
         self.rule_idx += 1
-        print("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
-        vehicle_type = Railway_System.capitalize_first_letter(cmd[4])
-        times_per_step = int(cmd[7])
-        time_step = cmd[10]
+        self._mutation = "rule"
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+        vehicle_type = symbols.capitalized(rule.vehicle_type)
+        times_per_step = rule.count
+        time_step = rule.step
         if vehicle_type == "Train":
             self.train_active_limit = True
         else:
@@ -661,12 +1620,80 @@ class Railway_System:
 
 
         # vehicle:Vehicle = None
-        # for vehicle in self._vehicles.values():
+        # for vehicle in self._vehicles:
         #     if vehicle.vehicle_type == vehicle_type:
         #         vehicle.active_times_limitation_for_else = True
         #         vehicle.reservation_step = time_step
         #         vehicle.reserve_limit = times_per_step
 
+    # command kind -> the method that runs it.
+    handlers = {
+        "book": book,
+        "cancel": cancel_reservation,
+        "cut_capacity": cut_the_capacity,
+        "age_limit": apply_age_limits,
+        "time_limit": apply_time_limit,
+        "count_limit_for_week": apply_reserves_count_for_week,
+        "count_limit_for_else": apply_reserves_count_for_else,
+    }
+
+    def execute(self, command):
+        # runs one command made by parse_command. commands have to come in (time, index) order,
+        # one at or before the watermark raises Stale_Command_Error and isn't run.
+        key = Railway_System.record_key(command)
+        if self.watermark != None and key <= self.watermark:
+            raise Stale_Command_Error(command.index, "at or before the watermark " + format_time(self.watermark[0]) + " (command " + str(self.watermark[1]) + ")")
+        if self.journal != None:
+            self.journal.start()
+        self.watermark = key
+        self._command = command
+        self._mutation = None
+        if self.journal == None:
+            Railway_System.handlers[command.kind](self, command)
+            return
+        # with a journal, the results of the command are handed to it with its record.
+        self._held = []
+        try:
+            Railway_System.handlers[command.kind](self, command)
+            self.journal.append(command, self._mutation, self.rule_idx, self._held)
+        finally:
+            self._held = None
+
+    def result(self, message:str, event:str = None):
+        # writes a result of the command being executed to the sink, or holds it in the journal
+        # until the command's record is durable.
+        if self._command != None:
+            record = (message, event if event != None else self._command.kind, self._command.index)
+        else:
+            record = (message, event, None)
+        if self._held != None:
+            self._held.append(record)
+        elif self.journal != None:
+            self.journal.hold([record])
+        else:
+            self.sink.write(*record)
+
+    def flush(self):
+        # writes out the results; with a journal, only once none of them waits for a group commit.
+        if self.journal != None:
+            self.journal.flush_results()
+        else:
+            self.sink.flush()
+
+    def close(self):
+        # the end of a run: the last group commit and its results, and the store's last batch.
+        # the store commits its batches by itself, so flush, which runs after every command of
+        # --stream, doesn't.
+        self.flush()
+        if self.journal != None:
+            self.journal.close()
+        self._reservations.commit()
+
+    def set_sink(self, sink:Result_Sink):
+        # with a Result_Collector the results are kept for print_result.
+        self.sink = sink
+        self._results = self.sink.results if isinstance(self.sink, Result_Collector) else []
+
     def print_result(self):
         # to be honest, I messed up, I thought results should be printed with input order
         # print_ready_ls = sorted(self._results, key=Railway_System.idx_key)
@@ -676,12 +1703,25 @@ class Railway_System:
 
     @staticmethod
     def time_key(ls):
-        return datetime.strptime(ls[0], "%Y/%m/%d-%H:%M")
+        return parse_time(ls[0])
+
+    @staticmethod
+    def record_key(record):
+        # commands run in time order, and in input order when times are equal.
+        return (record.time, record.index)
 
     @staticmethod
     def dep_time_key(vehicle:Vehicle):
         return vehicle.dep_time
     
+    @staticmethod
+    def departure_id_key(vehicle:Vehicle):
+        return vehicle.departure_id
+
+    @staticmethod
+    def reservation_id_key(reservation:Reservation):
+        return reservation.reservation_id
+
     @staticmethod
     def idx_key(ls):
         return ls[-1]
@@ -698,60 +1738,1520 @@ class Railway_System:
         return result[:-1]
     
 
-ali_baba = Railway_System()
-
-n = int(input())
-vehicles_commands = []
-vehicles_validity = True
-for i in range(n):
-    data = input().split()
-    if len(data) != 6 and len(data) != 5:
-        vehicles_validity = False
-    vehicles_commands.append(data)
-    if vehicles_validity:    
-        if data[-1].isdigit() and data[-1] != '0' and data[-2].isdigit() != False:
-            vehicles_commands[-1].append(input())
-
-if vehicles_validity:
-    for cmd in vehicles_commands:
-        ali_baba.add_vehicle(cmd)
-    print("Done")
-else:
-    print("Error")
-
-
-# if it didn't work, I will bring the whole block below under an if statement. if vehicles_validity...
-commands_list = []
-if vehicles_validity:
-    k = int(input())
-    for i in range(k):
-        data = input().split()
-        data.append(i)
-        commands_list.append(data)
-        
-    # print(*commands_list, sep='\n')
-    # print("====================================================================================================")
-    commands_list = sorted(commands_list, key=Railway_System.time_key)        
-    # print(*commands_list, sep='\n')
+class Railway_Fork:
+    """
+    A copy-on-write view of a Railway_System, for asking what a rule would cancel if it were
+    applied now.
+
+    Making a fork copies nothing: it keeps the reservation_id and departure_id the store and
+    the timetable would give next, so later reservations and departures are not in its view,
+    and registers itself in system.forks. Before the live system changes a vehicle's seats or
+    limits, a user's age or removes a reservation it calls preserve on every open fork, which
+    keeps the old value the first time. The fork's own changes go to the same overlays, so
+    the live system keeps serving and never sees them. apply runs a rule on the view, writes
+    the messages the live system would to the fork's sink (a Result_Collector unless another
+    one is given) and returns the cancelled reservations. Forks have to be closed, an open
+    fork is told about every change. Books and cancelations can't be run on a fork.
+    """
 
-        
-    for command in commands_list:
-        if command[-2] != "cancel" and (command[1] != "Zarfiat" and command[2] != "reserve" and command[3] != "baraye") and (command[1] != "Reserve" and command[3] != "baraye" and command[4] != "afrad") and (command[1] != "Reserve" and command[3] != "Reserve" and command[4] != "sa'at") and (command[1] != "Emkan"):
-            ali_baba.book(command)
-        elif command[1] == "Zarfiat" and command[2] == "reserve" and command[3] == "baraye":
-            ali_baba.cut_the_capacity(command)
-        elif command[1] == "Reserve" and command[3] == "baraye" and command[4] == "afrad":
-            ali_baba.apply_age_limits(command)
-        elif command[1] == "Reserve" and command[3] == "dar" and command[4] == "sa'at":
-            ali_baba.apply_time_limit(command)
-        elif command[1] == "Emkan":
-            if command[10] == "hafte":
-                ali_baba.apply_reserves_count_for_week(command)
-            else:
-                ali_baba.apply_reserves_count_for_else(command)
+    def __init__(self, system:Railway_System, sink:Result_Sink = None):
+        self._system = system
+        self.sink = sink if sink != None else Result_Collector()
+        self.rule_idx = system.rule_idx
+        self._next_reservation_id:int = system._reservations._next_id
+        self._next_departure_id:int = system._vehicles._next_id
+        self._vehicles:dict = {}        # departure_id as key and [capacity, primary_capacity, age_limitation] of the fork as value.
+        self._ages:dict = {}            # username as key and the user's age at the fork as value.
+        self._removed:dict = {}         # departure_id as key and a reservation_id keyed dict of reservations removed since the fork as value.
+        self._cancelled:set = set()     # reservation_id of the reservations the fork's rules cancelled.
+        self._command = None
+        system.forks.append(self)
+
+    def close(self):
+        if self in self._system.forks:
+            self._system.forks.remove(self)
+
+    def preserve(self, vehicle:Vehicle = None, reservation:Reservation = None, user:User = None):
+        # called by Railway_System.copy_on_write before the live state changes.
+        if vehicle != None:
+            self.vehicle_state(vehicle)
+        if reservation != None and reservation.reservation_id < self._next_reservation_id and reservation.reservation_id not in self._cancelled:
+            self._removed.setdefault(reservation.vehicle.departure_id, {})[reservation.reservation_id] = reservation
+        if user != None and user.name not in self._ages:
+            self._ages[user.name] = user.age
+
+    def vehicle_state(self, vehicle:Vehicle) -> list:
+        # the fork's [capacity, primary_capacity, age_limitation] of a vehicle, copied from the live one the first time.
+        state = self._vehicles.get(vehicle.departure_id)
+        if state == None:
+            state = self._vehicles[vehicle.departure_id] = [vehicle.capacity.copy(), vehicle.primary_capacity.copy(), vehicle.age_limitation]
+        return state
+
+    def capacity(self, vehicle:Vehicle) -> Seat_Counts:
+        state = self._vehicles.get(vehicle.departure_id)
+        return state[0] if state != None else vehicle.capacity
+
+    def age_limitation(self, vehicle:Vehicle) -> int:
+        state = self._vehicles.get(vehicle.departure_id)
+        return state[2] if state != None else vehicle.age_limitation
+
+    def age(self, user:User) -> int:
+        return self._ages.get(user.name, user.age)
+
+    def of_type(self, vehicle_type) -> list:
+        # the departures of vehicle_type the fork was made with.
+        return [vehicle for vehicle in self._system._vehicles.of_type(vehicle_type) if vehicle.departure_id < self._next_departure_id]
+
+    def reservations_of(self, vehicle:Vehicle) -> list:
+        # the reservations of vehicle at the fork, without the ones the fork cancelled, in the order they were made.
+        reservations = [reservation for reservation in self._system._reservations.of_vehicle(vehicle) if reservation.reservation_id < self._next_reservation_id]
+        reservations.extend(self._removed.get(vehicle.departure_id, {}).values())
+        reservations.sort(key=Railway_System.reservation_id_key)
+        return [reservation for reservation in reservations if reservation.reservation_id not in self._cancelled]
+
+    def result(self, message:str):
+        self.sink.write(message, self._command.kind, self._command.index)
+
+    def register_rule(self, rule):
+        self.rule_idx += 1
+        self.result("Qanoon shomareye " + str(self.rule_idx) + " ba movafaghiat sabt shod.")
+
+    def cancel(self, reserve:Reservation):
+        # cancels a reservation in the fork only, like the rules of Railway_System do.
+        self.vehicle_state(reserve.vehicle)[0][reserve.seat_type] += 1
+        self._cancelled.add(reserve.reservation_id)
+        if reserve.seat_type == '0':
+            self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model Normal be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+        else:
+            self.result("Reserve karbar " + reserve.user.name + " baraye " + symbols.lower(reserve.vehicle.vehicle_type) + " model VIP" + reserve.seat_type + " be dadil qanoon " + str(self.rule_idx) + " cancel shod.")
+
+    def cut_the_capacity(self, rule) -> list:
+        # Railway_System.cut_the_capacity on the fork's view.
+        self.register_rule(rule)
+        unavailable_percentage = 1 - (rule.percent / 100)
+        vehicles:list = self.of_type(symbols.capitalized(rule.vehicle_type))
+        for vehicle in vehicles:
+            capacity, primary_capacity = self.vehicle_state(vehicle)[:2]
+            for key in capacity.keys():
+                primary_capacity[key] = primary_capacity[key] - int(unavailable_percentage * vehicle.const_primary_capacity[key])
+                capacity[key] -= int(unavailable_percentage * vehicle.const_primary_capacity[key])
+
+        # the latest reservations of every overbooked seat type, like Reservation_Store.overbooked.
+        victims:list = []
+        for vehicle in vehicles:
+            capacity = self.capacity(vehicle)
+            overbooked = {key: -capacity[key] for key in capacity.keys() if capacity[key] < 0}
+            if len(overbooked) == 0:
+                continue
+            for reservation in reversed(self.reservations_of(vehicle)):
+                if len(overbooked) == 0:
+                    break
+                if reservation.seat_type in overbooked:
+                    victims.append(reservation)
+                    overbooked[reservation.seat_type] -= 1
+                    if overbooked[reservation.seat_type] == 0:
+                        del overbooked[reservation.seat_type]
+        victims.sort(key=Railway_System.reservation_id_key, reverse=True)
+        for reserve in victims:
+            self.cancel(reserve)
+        return victims
+
+    def apply_age_limits(self, rule) -> list:
+        # Railway_System.apply_age_limits on the fork's view.
+        self.register_rule(rule)
+        victims:list = []
+        for vehicle in self.of_type(symbols.capitalized(rule.vehicle_type)):
+            self.vehicle_state(vehicle)[2] = rule.age
+            victims.extend(reservation for reservation in self.reservations_of(vehicle) if self.age(reservation.user) > rule.age)
+        victims.sort(key=Railway_System.reservation_id_key)
+        for reserve in victims:
+            self.cancel(reserve)
+        return victims
+
+    def apply_other_rule(self, rule) -> list:
+        # the other rules only limit new reservations, they cancel nothing.
+        self.register_rule(rule)
+        return []
+
+    # rule kind -> the method that runs it on a fork.
+    handlers = {
+        "cut_capacity": cut_the_capacity,
+        "age_limit": apply_age_limits,
+        "time_limit": apply_other_rule,
+        "count_limit_for_week": apply_other_rule,
+        "count_limit_for_else": apply_other_rule,
+    }
+
+    def apply(self, rule) -> list:
+        # runs a rule made by parse_command on the fork, returns the reservations it cancelled.
+        if rule.kind not in Railway_Fork.handlers:
+            raise ValueError("a fork only runs rules, not " + rule.kind)
+        self._command = rule
+        return Railway_Fork.handlers[rule.kind](self, rule)
+
+
+class Command_Syntax_Error(ValueError):
+    """
+    A command line that doesn't fit any of the command forms.
+
+    index is the position of the line in the commands of the input.
+    """
+
+    def __init__(self, index:int, message:str):
+        ValueError.__init__(self, "command " + str(index) + ": " + message)
+        self.index = index
+
+
+class Stale_Command_Error(ValueError):
+    """
+    A command at or before the watermark of a Railway_System, i.e. older than the last
+    command it applied (see Railway_System.execute).
+    """
+
+    def __init__(self, index:int, message:str):
+        ValueError.__init__(self, "command " + str(index) + ": " + message)
+        self.index = index
+
+
+class Late_Command_Error(Stale_Command_Error):
+    """
+    A command that reached a Reorder_Buffer behind a command it already released, i.e.
+    more than its lateness minutes late (see Reorder_Buffer.push).
+    """
+
+
+class Command_Record:
+    """
+    One line of the input, tokenized once.
+
+    kind is "vehicle" for a vehicle definition, otherwise one of the keys of
+    Railway_System.handlers. time is the reservation / cancelation / rule time (dep_time
+    for vehicles) in minutes, index is the position of the command in the input. user,
+    origin, destination, vehicle and seat_type are None when the line doesn't have them.
+    tokens are kept only for vehicle lines: the raw tokens with the index appended and the
+    VIP capacity line as one more token. They are None for every other command.
+    Commands are built by parse_command as one of the subclasses below.
+    """
+
+    __slots__ = ('kind', 'time', 'user', 'origin', 'destination', 'vehicle', 'seat_type', 'index', 'tokens')
+
+    def __init__(self, kind:str, time:int, index:int, tokens:list, user:str = None, origin:str = None, destination:str = None, vehicle:str = None, seat_type:str = None):
+        self.kind = kind
+        self.time = time
+        self.index = index
+        self.tokens = tokens
+        self.user = user
+        self.origin = origin
+        self.destination = destination
+        self.vehicle = vehicle
+        self.seat_type = seat_type
+
+    @property
+    def route(self) -> tuple:
+        return (self.origin, self.destination)
+
+    @staticmethod
+    def from_vehicle_tokens(tokens:list, index:int):
+        return Command_Record("vehicle", parse_time(tokens[3]), index, tokens, origin=tokens[1], destination=tokens[2], vehicle=tokens[0], seat_type='0')
+
+    @staticmethod
+    def vehicle_and_seat(fields:list, index:int) -> tuple:
+        # fields are the optional vehicle and seat type of a book / cancel line.
+        # returns (vehicle, seat_type, departure), departure is None unless the vehicle is "Type@YYYY/MM/DD-HH:MM".
+        if len(fields) == 0:
+            vehicle, seat_type = "Auto", '0'
+        elif len(fields) == 1 and fields[0].isdigit():
+            vehicle, seat_type = "Auto", fields[0]
+        elif len(fields) == 1:
+            vehicle, seat_type = fields[0], '0'
+        elif fields[1].isdigit():
+            vehicle, seat_type = fields[0], fields[1]
+        else:
+            raise Command_Syntax_Error(index, "bad seat type " + repr(fields[1]))
+        departure = None
+        if '@' in vehicle:
+            vehicle, dep_time_str = vehicle.split('@', 1)
+            departure = parse_time(dep_time_str)
+        return (symbols.intern(vehicle), seat_type, departure)
+
+
+class Book_Command(Command_Record):
+    """
+    time user origin destination [vehicle] age [seat_type]
+    """
+
+    __slots__ = ('age', 'departure')
+
+    @staticmethod
+    def parse(kind:str, the_time:int, tokens:list, index:int):
+        if len(tokens) == 5:
+            fields, age = [], tokens[4]
+        elif len(tokens) == 6 and tokens[4].isdigit():
+            fields, age = tokens[5:6], tokens[4]
+        elif len(tokens) == 6:
+            fields, age = tokens[4:5], tokens[5]
+        elif len(tokens) == 7:
+            fields, age = [tokens[4], tokens[6]], tokens[5]
+        else:
+            raise Command_Syntax_Error(index, "a reservation has 5 to 7 words, not " + str(len(tokens)))
+        if not age.isdigit():
+            raise Command_Syntax_Error(index, "bad age " + repr(age))
+        vehicle, seat_type, departure = Command_Record.vehicle_and_seat(fields, index)
+        command = Book_Command(kind, the_time, index, None, user=symbols.intern(tokens[1]), origin=symbols.intern(tokens[2]), destination=symbols.intern(tokens[3]), vehicle=vehicle, seat_type=seat_type)
+        command.age = int(age)
+        command.departure = departure
+        return command
+
+
+class Cancel_Command(Command_Record):
+    """
+    time user origin destination [vehicle] [seat_type] cancel
+    """
+
+    __slots__ = ('departure',)
+
+    @staticmethod
+    def parse(kind:str, the_time:int, tokens:list, index:int):
+        if len(tokens) < 5 or len(tokens) > 7:
+            raise Command_Syntax_Error(index, "a cancelation has 5 to 7 words, not " + str(len(tokens)))
+        vehicle, seat_type, departure = Command_Record.vehicle_and_seat(tokens[4:-1], index)
+        command = Cancel_Command(kind, the_time, index, None, user=symbols.intern(tokens[1]), origin=symbols.intern(tokens[2]), destination=symbols.intern(tokens[3]), vehicle=vehicle, seat_type=seat_type)
+        command.departure = departure
+        return command
+
+
+class Rule_Command(Command_Record):
+    """
+    A rule line. vehicle_type is the vehicle word of the rule as written (e.g. "train"),
+    the subclasses add the numbers of their rule.
+    """
+
+    __slots__ = ('vehicle_type',)
+
+    # (position of the vehicle word, (field, position of its number), ...)
+    fields = (0, )
+    length = 0
+
+    @classmethod
+    def parse(cls, kind:str, the_time:int, tokens:list, index:int):
+        if len(tokens) != cls.length:
+            raise Command_Syntax_Error(index, "a " + kind + " rule has " + str(cls.length) + " words, not " + str(len(tokens)))
+        command = cls(kind, the_time, index, None)
+        command.vehicle_type = symbols.intern(tokens[cls.fields[0]])
+        for field, position in cls.fields[1:]:
+            if not tokens[position].isdigit():
+                raise Command_Syntax_Error(index, "bad number " + repr(tokens[position]))
+            setattr(command, field, int(tokens[position]))
+        return command
+
+
+class Capacity_Rule(Rule_Command):
+    """
+    time Zarfiat reserve baraye <vehicle> ha <percent> darsad ast
+    """
+
+    __slots__ = ('percent',)
+    fields = (4, ('percent', 6))
+    length = 9
+
+
+class Age_Rule(Rule_Command):
+    """
+    time Reserve <vehicle> baraye afrad bala <age> sal mamnoo ast
+    """
+
+    __slots__ = ('age',)
+    fields = (2, ('age', 6))
+    length = 10
+
+
+class Time_Rule(Rule_Command):
+    """
+    time Reserve <vehicle> dar sa'at <start_hour> ta <end_hour> mamnoo ast
+    """
+
+    __slots__ = ('start_hour', 'end_hour')
+    fields = (2, ('start_hour', 5), ('end_hour', 7))
+    length = 10
+
+
+class Count_Rule(Rule_Command):
+    """
+    time Emkan reserve baraye <vehicle> bish az <count> bar dar <step> vojood nadarad
+    """
+
+    __slots__ = ('count', 'step')
+    fields = (4, ('count', 7))
+    length = 13
+
+    @classmethod
+    def parse(cls, kind:str, the_time:int, tokens:list, index:int):
+        command = super().parse(kind, the_time, tokens, index)
+        command.step = tokens[10]
+        return command
+
+
+# the first word after the time -> (kind, {position: word the line must have there}, command class) in the order they are tried.
+# a line that starts with none of these words is a cancelation if it ends with "cancel" and a reservation otherwise.
+command_grammar = {
+    "Zarfiat": (("cut_capacity", {2: "reserve", 3: "baraye"}, Capacity_Rule), ),
+    "Reserve": (("age_limit", {3: "baraye", 4: "afrad"}, Age_Rule),
+                ("time_limit", {3: "dar", 4: "sa'at"}, Time_Rule)),
+    "Emkan": (("count_limit_for_week", {10: "hafte"}, Count_Rule),
+              ("count_limit_for_else", {}, Count_Rule)),
+}
+
+
+def command_form(cmd:list) -> tuple:
+    # (kind, command class) of a tokenized command line, None for an unknown rule.
+    if len(cmd) > 1 and cmd[1] in command_grammar:
+        for kind, words, command_class in command_grammar[cmd[1]]:
+            if all(position < len(cmd) and cmd[position] == word for position, word in words.items()):
+                return (kind, command_class)
+        return None
+    if cmd[-1] == "cancel":
+        return ("cancel", Cancel_Command)
+    return ("book", Book_Command)
+
+
+def classify_command(tokens:list, index:int) -> tuple:
+    # (kind, command class, time) of a command line: the part of parse_command that doesn't
+    # look at the words after the time. raises Command_Syntax_Error like parse_command.
+    if len(tokens) < 5:
+        raise Command_Syntax_Error(index, "too few words: " + " ".join(tokens))
+    form = command_form(tokens)
+    if form == None:
+        raise Command_Syntax_Error(index, "unknown " + tokens[1] + " rule: " + " ".join(tokens))
+    try:
+        return form + (parse_time(tokens[0]), )
+    except ValueError:
+        raise Command_Syntax_Error(index, "bad time " + repr(tokens[0]))
+
+
+def parse_command(tokens:list, index:int) -> Command_Record:
+    """
+    Classifies one command line by command_grammar and parses it into its typed command.
+
+    Raises Command_Syntax_Error, with the index of the line, if it fits none of the forms.
+    """
+    kind, command_class, the_time = classify_command(tokens, index)
+    try:
+        return command_class.parse(kind, the_time, tokens, index)
+    except Command_Syntax_Error:
+        raise
+    except ValueError as error:
+        # a bad departure time after '@'.
+        raise Command_Syntax_Error(index, str(error))
+
+
+def read_lines(source, chunk_size:int = 1 << 20):
+    # yields the lines of a file path or a binary stream (e.g. sys.stdin.buffer), reading it in big chunks.
+    # read1 doesn't wait for a whole chunk, so lines of a live stream come out as they arrive.
+    stream = open(source, 'rb') if isinstance(source, str) else source
+    read = stream.read1 if hasattr(stream, 'read1') else stream.read
+    try:
+        rest = b''
+        while True:
+            chunk = read(chunk_size)
+            if not chunk:
+                break
+            lines = (rest + chunk).split(b'\n')
+            rest = lines.pop()
+            for line in lines:
+                yield line.decode()
+        if rest:
+            yield rest.decode()
+    finally:
+        if stream is not source:
+            stream.close()
+
+
+def read_vehicles(lines) -> tuple:
+    """
+    Reads the vehicle count and the vehicle lines (with their optional VIP capacity line)
+    from an iterator of lines.
+
+    Returns (vehicle_records, vehicles_validity). The records are Command_Records if every
+    vehicle line was valid, and the raw token lists otherwise.
+    """
+    vehicle_records:list = []
+    vehicles_validity = True
+    for i in range(int(next(lines))):
+        data = next(lines).split()
+        if len(data) != 6 and len(data) != 5:
+            vehicles_validity = False
+        if vehicles_validity:
+            if data[-1].isdigit() and data[-1] != '0' and data[-2].isdigit() != False:
+                data.append(next(lines))
+        vehicle_records.append(data)
+    if vehicles_validity:
+        vehicle_records = [Command_Record.from_vehicle_tokens(data, i) for i, data in enumerate(vehicle_records)]
+    return (vehicle_records, vehicles_validity)
+
+
+def read_commands(lines, errors:list):
+    # yields the commands after the command count as they are read. a line that parse_command
+    # rejects is skipped and its Command_Syntax_Error is appended to errors.
+    for i in range(int(next(lines))):
+        try:
+            yield parse_command(next(lines).split(), i)
+        except Command_Syntax_Error as error:
+            errors.append(error)
+
+
+def read_input(source) -> tuple:
+    """
+    Reads the whole input in one pass: the vehicle count, the vehicle lines (with their
+    optional VIP capacity line), the command count and the commands.
+
+    Returns (vehicle_records, vehicles_validity, command_records, errors). The commands are
+    only read if every vehicle line was valid, like the interactive driver did. A command
+    line that parse_command rejects is left out of command_records and its
+    Command_Syntax_Error goes to errors.
+    """
+    lines = read_lines(source)
+    vehicle_records, vehicles_validity = read_vehicles(lines)
+    command_records:list = []
+    errors:list = []
+    if vehicles_validity:
+        command_records = list(read_commands(lines, errors))
+    return (vehicle_records, vehicles_validity, command_records, errors)
+
+
+class Reorder_Buffer:
+    """
+    Puts commands that arrive out of order back in (time, index) order, holding at most
+    the ones of the last `lateness` minutes.
+
+    A command may arrive up to lateness minutes after a later-timestamped one. The
+    watermark is the latest time seen minus lateness; no command older than it can still
+    arrive, so everything up to it is released. A command that arrives behind the last
+    released one is too late to be put in order and is refused.
+    """
+
+    __slots__ = ('lateness', 'watermark', '_heap', '_released')
+
+    def __init__(self, lateness:int = 0):
+        self.lateness = lateness
+        self.watermark:int = None
+        self._heap:list = []
+        self._released:tuple = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def push(self, command:Command_Record) -> list:
+        """
+        Adds a command and returns the commands it releases, in order.
+
+        Raises Late_Command_Error if the command is older than what was already released.
+        """
+        key = Railway_System.record_key(command)
+        if self._released != None and key < self._released:
+            raise Late_Command_Error(command.index, "arrived more than " + str(self.lateness) + " minutes late, behind "
+                                     + format_time(self._released[0]) + " (command " + str(self._released[1]) + ")")
+        heappush(self._heap, (key, command))
+        if self.watermark == None or command.time - self.lateness > self.watermark:
+            self.watermark = command.time - self.lateness
+        return self.release(self.watermark)
+
+    def release(self, watermark:int) -> list:
+        released:list = []
+        while len(self._heap) != 0 and self._heap[0][0][0] <= watermark:
+            key, command = heappop(self._heap)
+            self._released = key
+            released.append(command)
+        return released
+
+    def flush(self) -> list:
+        # the end of the input: nothing else can arrive.
+        released:list = []
+        while len(self._heap) != 0:
+            key, command = heappop(self._heap)
+            self._released = key
+            released.append(command)
+        return released
+
+
+def stream_commands(commands, lateness:int, errors:list):
+    # yields the commands in (time, index) order through a Reorder_Buffer, as soon as the
+    # watermark lets them go. late commands are skipped and their errors appended to errors.
+    buffer = Reorder_Buffer(lateness)
+    for command in commands:
+        try:
+            released = buffer.push(command)
+        except Late_Command_Error as error:
+            errors.append(error)
+            continue
+        for ready in released:
+            yield ready
+    for ready in buffer.flush():
+        yield ready
+
+
+class Mapped_Input:
+    """
+    A command file mapped into memory with mmap, for replaying big archives.
+
+    Iterating it decodes lines from the current position, which is how read_vehicles reads
+    the vehicles. index_commands then only scans the command lines: it keeps the offsets of
+    each line and its time, taken from the bytes of the first word, in arrays. commands()
+    yields them in (time, index) order and decodes and parses a line only when it is its
+    turn to run, so the input is never held as Python strings.
+    """
+
+    def __init__(self, path:str):
+        self._file = open(path, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # an empty file can't be mapped.
+            self._file.close()
+            raise ValueError("empty command file: " + path)
+        self.position = 0
+        self._starts = array('q')
+        self._ends = array('q')
+        self._times = array('q')
+        self._indexes = array('q')
+
+    def __iter__(self):
+        return self
+
+    def __next__(self) -> str:
+        start, end = self.next_line()
+        return self._map[start:end].decode()
+
+    def next_line(self) -> tuple:
+        # the (start, end) offsets of the next line, without its newline.
+        if self.position >= len(self._map):
+            raise StopIteration
+        start = self.position
+        end = self._map.find(b'\n', start)
+        if end == -1:
+            end = len(self._map)
+        self.position = end + 1
+        return (start, end)
+
+    def index_commands(self, errors:list):
+        # reads the command count and the offsets and times of the commands. a line with a bad
+        # time is left out and its Command_Syntax_Error is appended to errors.
+        for i in range(int(next(self))):
+            start, end = self.next_line()
+            space = self._map.find(b' ', start, end)
+            try:
+                the_time = parse_time(self._map[start:space if space != -1 else end].decode())
+            except ValueError:
+                errors.append(Command_Syntax_Error(i, "bad time in line " + repr(self._map[start:end].decode())))
+                continue
+            self._starts.append(start)
+            self._ends.append(end)
+            self._times.append(the_time)
+            self._indexes.append(i)
+
+    def __len__(self):
+        return len(self._times)
+
+    def commands(self, errors:list):
+        # yields the indexed commands in (time, index) order; a line that parse_command rejects
+        # is skipped and its Command_Syntax_Error is appended to errors.
+        times = self._times
+        # the positions are in input order, so the stable sort keeps ties in input order.
+        for position in sorted(range(len(times)), key=times.__getitem__):
+            line = self._map[self._starts[position]:self._ends[position]].decode()
+            try:
+                yield parse_command(line.split(), self._indexes[position])
+            except Command_Syntax_Error as error:
+                errors.append(error)
+
+    def close(self):
+        self._map.close()
+        self._file.close()
+
+
+# a command of a sorted run on disk: time, index and the byte length of the line, then the line.
+run_record = struct.Struct('<qqI')
+
+
+def write_run(records, directory:str) -> str:
+    # writes (time, index, line) records, already sorted, to a new run file in directory and closes it.
+    descriptor, path = tempfile.mkstemp(dir=directory, suffix=".run")
+    with os.fdopen(descriptor, 'wb') as run_file:
+        for the_time, index, line in records:
+            data = line.encode()
+            run_file.write(run_record.pack(the_time, index, len(data)))
+            run_file.write(data)
+    return path
+
+
+def read_run(path:str):
+    # yields the (time, index, line) of a run written by write_run, and deletes it at the end.
+    run_file = open(path, 'rb')
+    try:
+        while True:
+            header = run_file.read(run_record.size)
+            if not header:
+                break
+            the_time, index, length = run_record.unpack(header)
+            yield (the_time, index, run_file.read(length).decode())
+    finally:
+        run_file.close()
+        os.remove(path)
+
+
+def external_sort_commands(lines, errors:list, run_size:int = 1 << 16, fan_in:int = 64):
+    """
+    Yields the commands after the command count in (time, index) order, holding at most
+    run_size of them in memory.
+
+    The commands are read in runs of run_size, each run is sorted and written to a
+    temporary file as compact records, and the runs are k-way merged. A run file is only
+    open while it is written or merged, and at most fan_in runs are merged at once: while
+    there are more, every fan_in of them are merged into one longer run first. Ties keep the
+    input order, like the stable sort of main, since the index is part of the key.
+
+    A line is only parsed in full once, when it comes out of the merge; the runs only need
+    its time, from classify_command. A line that classify_command rejects is skipped while
+    the runs are written, one that parse_command rejects when it comes out of the merge;
+    either way its Command_Syntax_Error is appended to errors.
+    """
+    directory = tempfile.mkdtemp(prefix="railway-runs-")
+    try:
+        runs:list = []
+        run:list = []
+        for i in range(int(next(lines))):
+            line = next(lines)
+            try:
+                kind, command_class, the_time = classify_command(line.split(), i)
+            except Command_Syntax_Error as error:
+                errors.append(error)
+                continue
+            run.append((the_time, i, line))
+            if len(run) >= run_size:
+                run.sort()
+                runs.append(write_run(run, directory))
+                run = []
+        if len(run) != 0:
+            run.sort()
+            runs.append(write_run(run, directory))
+        while len(runs) > fan_in:
+            runs = [write_run(merge(*[read_run(path) for path in runs[i:i + fan_in]]), directory) for i in range(0, len(runs), fan_in)]
+        for the_time, index, line in merge(*[read_run(path) for path in runs]):
+            try:
+                command = parse_command(line.split(), index)
+            except Command_Syntax_Error as error:
+                errors.append(error)
+                continue
+            yield command
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+class Command_Log:
+    """
+    A binary command log: the input already parsed and sorted, so replaying it doesn't parse
+    any text.
+
+    The file is the magic and version, an interned string table (users, cities, vehicle
+    words, seat types and rule words, each stored once), the vehicle lines as lists of
+    string ids, and then one fixed-size record per command in (time, index) order. A record
+    has the kind, index, time, the string ids of user, origin, destination, vehicle, seat
+    type and rule word, the departure time and two numbers, whose meaning depends on the
+    kind (the age of a reservation or an age rule, the percent of a capacity rule, the hours
+    of a time rule, the count of a count rule). Unused fields are Command_Log.none.
+    """
+
+    magic = b'RLOG'
+    version = 1
+    none = 0xFFFFFFFF
+    header = struct.Struct('<4sHBI')
+    record = struct.Struct('<BIiIIIIIIiii')
+    kinds = ("book", "cancel", "cut_capacity", "age_limit", "time_limit", "count_limit_for_week", "count_limit_for_else")
+    # command class of a kind, and the attributes stored in the two numbers of its record.
+    layouts = {
+        "book": (Book_Command, ('age', None)),
+        "cancel": (Cancel_Command, (None, None)),
+        "cut_capacity": (Capacity_Rule, ('percent', None)),
+        "age_limit": (Age_Rule, ('age', None)),
+        "time_limit": (Time_Rule, ('start_hour', 'end_hour')),
+        "count_limit_for_week": (Count_Rule, ('count', None)),
+        "count_limit_for_else": (Count_Rule, ('count', None)),
+    }
+
+    @staticmethod
+    def write(path:str, vehicle_records:list, vehicles_validity:bool, commands) -> int:
+        """
+        Writes a log of read_vehicles' output and of commands, which must already be sorted
+        by Railway_System.record_key. Returns the number of commands written.
+        """
+        strings:dict = {}
+        def intern(string):
+            if string == None:
+                return Command_Log.none
+            if string not in strings:
+                strings[string] = len(strings)
+            return strings[string]
+
+        vehicles = [[intern(token) for token in record.tokens] for record in vehicle_records] if vehicles_validity else []
+        body = bytearray()
+        count = 0
+        for command in commands:
+            body += Command_Log.pack_command(command, intern)
+            count += 1
+
+        with open(path, 'wb') as log:
+            table = list(strings)
+            log.write(Command_Log.header.pack(Command_Log.magic, Command_Log.version, 1 if vehicles_validity else 0, len(table)))
+            for string in table:
+                data = string.encode()
+                log.write(struct.pack('<I', len(data)))
+                log.write(data)
+            log.write(struct.pack('<I', len(vehicles)))
+            for tokens in vehicles:
+                log.write(struct.pack('<H', len(tokens)))
+                log.write(struct.pack('<' + str(len(tokens)) + 'I', *tokens))
+            log.write(struct.pack('<q', count))
+            log.write(body)
+        return count
+
+    @staticmethod
+    def pack_command(command:Command_Record, intern) -> bytes:
+        # the record of a command, intern gives the string id of a string (Command_Log.none for None).
+        number_fields = Command_Log.layouts[command.kind][1]
+        numbers = [getattr(command, field) if field != None else 0 for field in number_fields]
+        departure = getattr(command, 'departure', None)
+        return Command_Log.record.pack(Command_Log.kinds.index(command.kind), command.index, command.time,
+                                       intern(command.user), intern(command.origin), intern(command.destination),
+                                       intern(command.vehicle if command.vehicle != None else getattr(command, 'vehicle_type', None)),
+                                       intern(command.seat_type), intern(getattr(command, 'step', None)),
+                                       departure if departure != None else -1, numbers[0], numbers[1])
+
+    @staticmethod
+    def unpack_command(fields:tuple, table:list) -> Command_Record:
+        # the command of an unpacked record, table is the string table with None appended.
+        kind, index, the_time, user, origin, destination, vehicle, seat_type, word, departure, first, second = fields
+        none = Command_Log.none
+        kind = Command_Log.kinds[kind]
+        command_class, number_fields = Command_Log.layouts[kind]
+        if issubclass(command_class, Rule_Command):
+            command = command_class(kind, the_time, index, None)
+            command.vehicle_type = table[vehicle if vehicle != none else -1]
+            if command_class is Count_Rule:
+                command.step = table[word if word != none else -1]
+        else:
+            command = command_class(kind, the_time, index, None, user=table[user], origin=table[origin], destination=table[destination],
+                                    vehicle=table[vehicle], seat_type=table[seat_type])
+            command.departure = departure if departure != -1 else None
+        for field, number in zip(number_fields, (first, second)):
+            if field != None:
+                setattr(command, field, number)
+        return command
+
+    @staticmethod
+    def read(path:str, chunk_records:int = 1 << 14) -> tuple:
+        """
+        Opens a log written by write. Returns (vehicle_records, vehicles_validity, commands),
+        commands being a generator of the typed commands in the order they were written.
+
+        Raises ValueError if the file isn't a command log of this version.
+        """
+        log = open(path, 'rb')
+        try:
+            magic, version, validity, string_count = Command_Log.header.unpack(log.read(Command_Log.header.size))
+            if magic != Command_Log.magic or version != Command_Log.version:
+                raise ValueError(path + " is not a version " + str(Command_Log.version) + " command log")
+            table:list = []
+            for i in range(string_count):
+                length, = struct.unpack('<I', log.read(4))
+                table.append(symbols.intern(log.read(length).decode()))
+            vehicle_records:list = []
+            vehicle_count, = struct.unpack('<I', log.read(4))
+            for i in range(vehicle_count):
+                token_count, = struct.unpack('<H', log.read(2))
+                ids = struct.unpack('<' + str(token_count) + 'I', log.read(4 * token_count))
+                vehicle_records.append(Command_Record.from_vehicle_tokens([table[string_id] for string_id in ids], i))
+            command_count, = struct.unpack('<q', log.read(8))
+        except Exception:
+            log.close()
+            raise
+        return (vehicle_records, validity == 1, Command_Log.commands(log, table, command_count, chunk_records))
+
+    @staticmethod
+    def commands(log, table:list, command_count:int, chunk_records:int):
+        # yields the records of an open log as typed commands, reading chunk_records at a time.
+        table = table + [None]
+        try:
+            left = command_count
+            while left > 0:
+                data = log.read(Command_Log.record.size * min(left, chunk_records))
+                for fields in Command_Log.record.iter_unpack(data):
+                    yield Command_Log.unpack_command(fields, table)
+                left -= len(data) // Command_Log.record.size
+        finally:
+            log.close()
+
+
+class Snapshot:
+    """
+    A versioned binary image of the state of a Railway_System.
+
+    It has the watermark, the vehicles with their departure_ids, capacities (current, primary and constant
+    primary) and rule fields, the users, the live reservations with their reservation_ids,
+    the pending VIP cancelation queues, and the rule counters and rate limits of the system.
+    Names are written once, in a string table. restore builds the objects and indexes
+    straight from it, without running any command or rule, so it takes time in proportion
+    to the size of the state.
+
+    Snapshot(system).save(path) writes one, Snapshot.restore(path) reads one back.
+    """
+
+    magic = b'RSNP'
+    version = 2
+    # version 1 had no watermark.
+    versions = (1, 2)
+    header = struct.Struct('<4sH')
+    # the counters of Railway_System, in this order.
+    system_fields = ('rule_idx', 'train_reserve_count_limit', 'airplane_reserve_count_limit', 'train_reserves_in_this_period',
+                     'airplane_reserves_in_this_period', 'airplane_active_limit', 'train_active_limit')
+    # the rule fields of Vehicle, in this order. they can be None, an int, a bool or a string.
+    vehicle_fields = ('age_limitation', 'time_limit', 'start_time', 'end_time', 'active_times_limitation',
+                      'active_times_limitation_for_else', 'last_reservation', 'reservation_step', 'reserves_in_this_step', 'reserve_limit')
+
+    def __init__(self, system = None):
+        self.system:Railway_System = system
+        self.data = bytearray()
+        self.offset = 0
+        self._strings:dict = {}
+        self._table:list = []
+
+    def pack(self, fmt:str, *values):
+        self.data += struct.pack('<' + fmt, *values)
+
+    def unpack(self, fmt:str) -> tuple:
+        values = struct.unpack_from('<' + fmt, self.data, self.offset)
+        self.offset += struct.calcsize('<' + fmt)
+        return values
+
+    def string(self, string:str) -> int:
+        if string not in self._strings:
+            self._strings[string] = len(self._strings)
+        return self._strings[string]
+
+    def pack_value(self, value):
+        # a tagged value: 0 None, 1 bool, 2 int, 3 string.
+        if value == None:
+            self.pack('B', 0)
+        elif isinstance(value, bool):
+            self.pack('BB', 1, value)
+        elif isinstance(value, int):
+            self.pack('Bq', 2, value)
+        else:
+            self.pack('BI', 3, self.string(value))
+
+    def unpack_value(self):
+        tag, = self.unpack('B')
+        if tag == 0:
+            return None
+        if tag == 1:
+            return self.unpack('B')[0] == 1
+        if tag == 2:
+            return self.unpack('q')[0]
+        return self._table[self.unpack('I')[0]]
+
+    def pack_ints(self, values):
+        values = list(values)
+        self.pack('I' + str(len(values)) + 'q', len(values), *values)
+
+    def unpack_ints(self) -> list:
+        count, = self.unpack('I')
+        return list(self.unpack(str(count) + 'q'))
+
+    def save(self, path:str):
+        data = self.encode()
+        with open(path, 'wb') as snapshot_file:
+            snapshot_file.write(data)
+
+    def encode(self) -> bytes:
+        system = self.system
+        self.data = bytearray()
+        for field in Snapshot.system_fields:
+            self.pack_value(getattr(system, field))
+        for value in (system.watermark if system.watermark != None else (None, None)):
+            self.pack_value(value)
+
+        vehicles:list = sorted(system._vehicles, key=Railway_System.departure_id_key)
+        self.pack('qI', system._vehicles._next_id, len(vehicles))
+        for vehicle in vehicles:
+            self.pack('qIIIq', vehicle.departure_id, self.string(vehicle.vehicle_type), self.string(vehicle.origin), self.string(vehicle.destination), vehicle.dep_time)
+            for seat_counts in (vehicle.capacity, vehicle.primary_capacity, vehicle.const_primary_capacity):
+                self.pack_ints(seat_counts.values())
+            for field in Snapshot.vehicle_fields:
+                self.pack_value(getattr(vehicle, field))
+
+        self.pack('I', len(system._users))
+        for user in system._users.values():
+            self.pack('I', self.string(user.name))
+            self.pack_value(user.age)
+            self.pack_value(user.last_cancelation)
+            self.pack_ints(user.reservation_date_record)
+
+        store:Reservation_Store = system._reservations
+        self.pack('qI', store._next_id, len(store))
+        for reservation in store:
+            self.pack('qIqqI', reservation.reservation_id, self.string(reservation.user.name), reservation.vehicle.departure_id, reservation.time, self.string(reservation.seat_type))
+
+        # only the requests still pending, in queue order.
+        queues:list = [(vehicle, seat_type, [reservation.reservation_id for reservation in requests if vehicle.is_cancelation_in_list(reservation) and reservation in store])
+                       for vehicle in vehicles for seat_type, requests in vehicle._cancelation_requests.items()]
+        queues = [queue for queue in queues if len(queue[2]) != 0]
+        self.pack('I', len(queues))
+        for vehicle, seat_type, reservation_ids in queues:
+            self.pack('qI', vehicle.departure_id, self.string(seat_type))
+            self.pack_ints(reservation_ids)
+
+        body = self.data
+        self.data = bytearray(Snapshot.header.pack(Snapshot.magic, Snapshot.version))
+        self.pack('I', len(self._strings))
+        for string in self._strings:
+            data = string.encode()
+            self.pack('I', len(data))
+            self.data += data
+        self.data += body
+        return bytes(self.data)
+
+    @staticmethod
+    def restore(path:str, storage:str = "objects", sink:Result_Sink = None, storage_options:dict = None):
+        """
+        Reads a snapshot written by save into a new Railway_System.
+
+        Raises ValueError if the file isn't a snapshot of this version, or if the store the
+        storage_options open (e.g. an existing SQLite database) already has reservations.
+        """
+        with open(path, 'rb') as snapshot_file:
+            return Snapshot.decode(snapshot_file.read(), storage, sink, path, storage_options)
+
+    @staticmethod
+    def decode(data:bytes, storage:str = "objects", sink:Result_Sink = None, path:str = "the data", storage_options:dict = None):
+        snapshot = Snapshot()
+        snapshot.data = data
+        magic, version = snapshot.unpack(Snapshot.header.format[1:])
+        if magic != Snapshot.magic or version not in Snapshot.versions:
+            raise ValueError(path + " is not a snapshot of version " + " or ".join(str(known) for known in Snapshot.versions))
+        for i in range(snapshot.unpack('I')[0]):
+            length, = snapshot.unpack('I')
+            snapshot._table.append(symbols.intern(bytes(snapshot.data[snapshot.offset:snapshot.offset + length]).decode()))
+            snapshot.offset += length
+        table = snapshot._table
+
+        system = Railway_System(storage, sink, storage_options)
+        system.restored = True
+        for field in Snapshot.system_fields:
+            setattr(system, field, snapshot.unpack_value())
+        if version >= 2:
+            watermark = (snapshot.unpack_value(), snapshot.unpack_value())
+            system.watermark = watermark if watermark[0] != None else None
+
+        next_departure_id, vehicle_count = snapshot.unpack('qI')
+        vehicles:list = []
+        departures:dict = {}
+        for i in range(vehicle_count):
+            departure_id, vehicle_type, origin, destination, dep_time = snapshot.unpack('qIIIq')
+            vehicle = Vehicle(table[vehicle_type], table[origin], table[destination], dep_time, Seat_Counts(snapshot.unpack_ints()))
+            vehicle.primary_capacity = Seat_Counts(snapshot.unpack_ints())
+            vehicle.const_primary_capacity = Seat_Counts(snapshot.unpack_ints())
+            for field in Snapshot.vehicle_fields:
+                setattr(vehicle, field, snapshot.unpack_value())
+            vehicle.departure_id = departure_id
+            vehicles.append(vehicle)
+            departures[departure_id] = vehicle
+        system._vehicles.restore(vehicles, next_departure_id)
+
+        for i in range(snapshot.unpack('I')[0]):
+            user = User(table[snapshot.unpack('I')[0]], snapshot.unpack_value())
+            user.last_cancelation = snapshot.unpack_value()
+            user.reservation_date_record = snapshot.unpack_ints()
+            system._users[user.name] = user
+
+        store:Reservation_Store = system._reservations
+        next_reservation_id, reservation_count = snapshot.unpack('qI')
+        reservations:dict = {}
+        for i in range(reservation_count):
+            reservation_id, username, departure_id, time, seat_type = snapshot.unpack('qIqqI')
+            reservation = Reservation(system._users[table[username]], departures[departure_id], time, table[seat_type])
+            # Reservation_Store.add gives the next id, so it is set to the saved one first.
+            store._next_id = reservation_id
+            store.add(reservation)
+            reservations[reservation_id] = reservation
+        store._next_id = next_reservation_id
+
+        for i in range(snapshot.unpack('I')[0]):
+            departure_id, seat_type = snapshot.unpack('qI')
+            vehicle:Vehicle = departures[departure_id]
+            for reservation_id in snapshot.unpack_ints():
+                vehicle.add_cancelation_request(reservations[reservation_id])
+        return system
+
+
+class Journal:
+    """
+    An append-only redo journal of a Railway_System, with checkpoints.
+
+    directory holds snapshot.<generation> and journal.<generation> files. The snapshot of a
+    generation is the state before the first record of its journal. Every command that
+    changed the state is appended with its mutation (one of Journal.mutations) and the
+    rule_idx after it. Commands are deterministic, so recover restores the newest snapshot and
+    executes the records of that generation's journal and of the later ones again.
+
+    Records are buffered and written with one fsync per group commit: when batch_size
+    records are waiting, on commit or close, and from a flusher thread once the first waiting
+    record has waited batch_interval seconds, also while no command comes. A crash loses at
+    most the last batch. The results of the commands are held here too and only go to the
+    system's sink after the group commit of their records (results of commands that changed
+    nothing go out as soon as nothing before them is waiting), so no result is out before its
+    command is durable, whatever the sink buffers. Every checkpoint_every records a
+    checkpoint starts a new generation: the state is encoded at once, and a background thread
+    writes and fsyncs the snapshot, renames it in place and deletes the older snapshots and
+    journals. So recovery never has to read more than about checkpoint_every records.
+    The first checkpoint is made when the first command runs, after the vehicles are loaded.
+    """
+
+    mutations = ("book", "book_rejected", "cancel", "queued_cancel", "rule")
+    # a record: the payload length, the crc32 of the payload and the record type.
+    frame = struct.Struct('<IIB')
+    string_record = 0       # the payload is the next string of the journal's string table.
+    command_record = 1      # the payload is the mutation and rule_idx, then a Command_Log record.
+    command_header = struct.Struct('<Bq')
+
+    def __init__(self, system:Railway_System, directory:str, generation:int, batch_size:int = 256, batch_interval:float = 0.05, checkpoint_every:int = 100000):
+        self.system = system
+        self.directory = directory
+        self.generation = generation
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        self.checkpoint_every = checkpoint_every
+        self._file = None
+        self._strings:dict = {}         # the string table of the current journal file.
+        self._buffer = bytearray()
+        self._waiting = 0               # records in the buffer.
+        self._first_wait:float = None
+        self._records = 0               # records since the last checkpoint.
+        self._checkpoint_thread:threading.Thread = None
+        self._lock = threading.Lock()   # the buffer, the file, the held results and the sink are shared with the flusher thread.
+        self._results:list = []         # (message, event, index) results held until their records are durable.
+        self._closing = threading.Event()
+        self._flusher:threading.Thread = None
+
+    @staticmethod
+    def attach(system:Railway_System, directory:str, **options):
+        # starts journaling system in directory, after the generations already there.
+        os.makedirs(directory, exist_ok=True)
+        generations = Journal.generations(directory, "snapshot") + Journal.generations(directory, "journal")
+        system.journal = Journal(system, directory, max(generations, default=-1) + 1, **options)
+        return system.journal
+
+    @staticmethod
+    def generations(directory:str, prefix:str) -> list:
+        # the generations of the prefix files in directory, sorted.
+        found:list = []
+        if os.path.isdir(directory):
+            for name in os.listdir(directory):
+                parts = name.split('.')
+                if len(parts) == 2 and parts[0] == prefix and parts[1].isdigit():
+                    found.append(int(parts[1]))
+        return sorted(found)
+
+    def path(self, prefix:str, generation:int) -> str:
+        return os.path.join(self.directory, prefix + '.' + str(generation))
+
+    def start(self):
+        # the first checkpoint and the flusher thread, called before the first command runs.
+        if self._file == None:
+            self.checkpoint(wait=True)
+            self._flusher = threading.Thread(target=self.flush_loop, daemon=True)
+            self._flusher.start()
+
+    def append(self, command:Command_Record, mutation:str, rule_idx:int, results:list = ()):
+        # journals a command that changed the state (mutation None for one that didn't) and holds its results.
+        with self._lock:
+            if mutation != None:
+                payload = Journal.command_header.pack(Journal.mutations.index(mutation), rule_idx) + Command_Log.pack_command(command, self.intern)
+                self.write_record(Journal.command_record, payload)
+                self._waiting += 1
+                if self._first_wait == None:
+                    self._first_wait = time.monotonic()
+            self._results.extend(results)
+            if self._waiting == 0:
+                self.release_results()
+            full = self._waiting >= self.batch_size
+        if full or self._records >= self.checkpoint_every:
+            self.commit()
+
+    def hold(self, results:list):
+        # results that aren't of a journaled command, they wait only for the ones before them.
+        self.append(None, None, 0, results)
+
+    def release_results(self):
+        # hands the held results to the sink, called with the lock held once nothing before them waits.
+        for message, event, index in self._results:
+            self.system.sink.write(message, event, index)
+        self._results = []
+
+    def flush_results(self):
+        # Railway_System.flush: the sink is flushed if no result waits for a group commit.
+        with self._lock:
+            if self._waiting == 0:
+                self.release_results()
+                self.system.sink.flush()
+
+    def flush_loop(self):
+        # the flusher thread: writes the waiting records once the first of them waited batch_interval seconds.
+        timeout = self.batch_interval
+        while not self._closing.wait(timeout):
+            first_wait = self._first_wait
+            timeout = self.batch_interval
+            if first_wait != None:
+                if time.monotonic() - first_wait >= self.batch_interval:
+                    self.write_batch()
+                else:
+                    timeout = first_wait + self.batch_interval - time.monotonic()
+
+    def intern(self, string:str) -> int:
+        # the id of string in the current journal file, a string record is written the first time.
+        if string == None:
+            return Command_Log.none
+        if string not in self._strings:
+            self._strings[string] = len(self._strings)
+            self.write_record(Journal.string_record, string.encode())
+        return self._strings[string]
+
+    def write_record(self, record_type:int, payload:bytes):
+        self._buffer += Journal.frame.pack(len(payload), zlib.crc32(payload), record_type)
+        self._buffer += payload
+
+    def commit(self):
+        # the group commit, and a checkpoint if checkpoint_every records were committed since the last one.
+        # checkpoints are only made here, by the thread running the commands.
+        self.write_batch()
+        if self._records >= self.checkpoint_every:
+            self.checkpoint()
+
+    def write_batch(self):
+        # one write and one fsync for every waiting record, then their results go out.
+        with self._lock:
+            if self._waiting == 0:
+                return
+            self._file.write(self._buffer)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._records += self._waiting
+            self._buffer = bytearray()
+            self._waiting = 0
+            self._first_wait = None
+            self.release_results()
+            self.system.sink.flush()
+
+    def checkpoint(self, wait:bool = False):
+        """
+        Starts a new generation with a snapshot of the current state.
+
+        The state is encoded here. Writing the snapshot and deleting the older files happen in
+        a background thread, or before returning if wait is True. A checkpoint is skipped
+        while the previous one is still being written.
+        """
+        if self._checkpoint_thread != None:
+            if self._checkpoint_thread.is_alive() and not wait:
+                return
+            self._checkpoint_thread.join()
+        self.write_batch()
+        data = Snapshot(self.system).encode()
+        with self._lock:
+            generation = self.generation if self._file == None else self.generation + 1
+            if self._file != None:
+                self._file.close()
+            self.generation = generation
+            self._file = open(self.path("journal", generation), 'ab')
+            self._strings = {}
+            self._records = 0
+        self._checkpoint_thread = threading.Thread(target=self.write_snapshot, args=(data, generation), daemon=True)
+        self._checkpoint_thread.start()
+        if wait:
+            self._checkpoint_thread.join()
+
+    def write_snapshot(self, data:bytes, generation:int):
+        path = self.path("snapshot", generation)
+        with open(path + ".tmp", 'wb') as snapshot_file:
+            snapshot_file.write(data)
+            snapshot_file.flush()
+            os.fsync(snapshot_file.fileno())
+        os.replace(path + ".tmp", path)
+        if hasattr(os, 'O_DIRECTORY'):
+            directory = os.open(self.directory, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(directory)
+            finally:
+                os.close(directory)
+        # the new snapshot has everything the older files had.
+        for prefix in ("snapshot", "journal"):
+            for old_generation in Journal.generations(self.directory, prefix):
+                if old_generation < generation:
+                    os.remove(self.path(prefix, old_generation))
+
+    def close(self):
+        self.start()
+        self._closing.set()
+        self._flusher.join()
+        self.commit()
+        self.flush_results()
+        if self._checkpoint_thread != None:
+            self._checkpoint_thread.join()
+        self._file.close()
+        self.system.journal = None
+
+    @staticmethod
+    def recover(directory:str, storage:str = "objects", sink:Result_Sink = None, storage_options:dict = None):
+        """
+        Rebuilds the Railway_System journaled in directory: its newest snapshot, and the
+        records of its journals from that generation on executed again. None if directory has
+        no snapshot. A torn record at the end of the last journal, from a crash during a
+        write, ends the recovery.
+
+        Raises ValueError if a rule record doesn't get the rule_idx it was journaled with.
+        """
+        snapshots = Journal.generations(directory, "snapshot")
+        if len(snapshots) == 0:
+            return None
+        generation = snapshots[-1]
+        system = Snapshot.restore(os.path.join(directory, "snapshot." + str(generation)), storage, Result_Collector(), storage_options)
+        for journal_generation in Journal.generations(directory, "journal"):
+            if journal_generation < generation:
+                continue
+            with open(os.path.join(directory, "journal." + str(journal_generation)), 'rb') as journal_file:
+                data = journal_file.read()
+            if not Journal.replay(system, data):
+                break
+        system.set_sink(sink if sink != None else Text_Sink())
+        return system
+
+    @staticmethod
+    def replay(system:Railway_System, data:bytes) -> bool:
+        # executes the records of one journal file again, False if it ends with a torn record.
+        table:list = []
+        offset = 0
+        while offset < len(data):
+            if offset + Journal.frame.size > len(data):
+                return False
+            length, checksum, record_type = Journal.frame.unpack_from(data, offset)
+            payload = data[offset + Journal.frame.size:offset + Journal.frame.size + length]
+            if len(payload) != length or zlib.crc32(payload) != checksum:
+                return False
+            offset += Journal.frame.size + length
+            if record_type == Journal.string_record:
+                table.append(symbols.intern(payload.decode()))
+                continue
+            mutation, rule_idx = Journal.command_header.unpack_from(payload)
+            command = Command_Log.unpack_command(Command_Log.record.unpack_from(payload, Journal.command_header.size), table + [None])
+            system.execute(command)
+            if Journal.mutations[mutation] == "rule" and system.rule_idx != rule_idx:
+                raise ValueError("the journal doesn't match its snapshot: rule " + str(system.rule_idx) + " was journaled as " + str(rule_idx))
+        return True
+
+
+def convert_input(source, path:str) -> int:
+    # writes the text input of source to a Command_Log at path, sorted like run_input does.
+    vehicle_records, vehicles_validity, commands_list, errors = read_input(source)
+    for error in errors:
+        print("Error: " + str(error), file=sys.stderr)
+    return Command_Log.write(path, vehicle_records, vehicles_validity, sorted(commands_list, key=Railway_System.record_key))
+
+
+def log_input(system:Railway_System, path:str):
+    # the replay driver of a Command_Log: the commands come out sorted and parsed.
+    vehicle_records, vehicles_validity, commands = Command_Log.read(path)
+    if not load_vehicles(system, vehicle_records, vehicles_validity):
+        commands.close()
+        return
+    for command in commands:
+        run_command(system, command)
+
+
+def run_command(system:Railway_System, command:Command_Record):
+    # executes a command for the drivers, a command older than the watermark is reported on stderr.
+    command.index += system.index_base
+    try:
+        system.execute(command)
+    except Stale_Command_Error as error:
+        print("Error: " + str(error), file=sys.stderr)
+
+
+def load_vehicles(system:Railway_System, vehicle_records:list, vehicles_validity:bool) -> bool:
+    # adds the vehicles of read_vehicles and writes "Done", or "Error" if a vehicle line was invalid.
+    # a restored system has its vehicles already.
+    if vehicles_validity:
+        if not system.restored:
+            for record in vehicle_records:
+                system.add_vehicle(record.tokens)
+        system.result("Done", "vehicles")
+    else:
+        system.result("Error", "vehicles")
+    return vehicles_validity
+
+
+def stream_input(system:Railway_System, source, lateness:int):
+    # the streaming driver: output for a command comes out once the watermark passes it,
+    # and only the reorder window is kept in memory.
+    lines = read_lines(source)
+    if not load_vehicles(system, *read_vehicles(lines)):
+        return
+    system.flush()
+
+    errors:list = []
+    for command in stream_commands(read_commands(lines, errors), lateness, errors):
+        while len(errors) != 0:
+            print("Error: " + str(errors.pop(0)), file=sys.stderr)
+        run_command(system, command)
+        system.flush()
+    for error in errors:
+        print("Error: " + str(error), file=sys.stderr)
+
+
+def sorted_input(system:Railway_System, source, run_size:int):
+    # the out-of-core driver: like run_input, but the commands are ordered by external_sort_commands.
+    lines = read_lines(source)
+    if not load_vehicles(system, *read_vehicles(lines)):
+        return
+
+    errors:list = []
+    # every line is read before the first command comes out of the merge, the lines that
+    # only fail parse_command are reported as the merge reaches them.
+    for command in external_sort_commands(lines, errors, run_size):
+        while len(errors) != 0:
+            print("Error: " + str(errors.pop(0)), file=sys.stderr)
+        run_command(system, command)
+    for error in errors:
+        print("Error: " + str(error), file=sys.stderr)
+
+
+def mapped_input(system:Railway_System, path:str):
+    # the mmap driver: like run_input, but a line is only decoded when its command runs.
+    mapped = Mapped_Input(path)
+    try:
+        if not load_vehicles(system, *read_vehicles(mapped)):
+            return
+        errors:list = []
+        mapped.index_commands(errors)
+        for command in mapped.commands(errors):
+            while len(errors) != 0:
+                print("Error: " + str(errors.pop(0)), file=sys.stderr)
+            run_command(system, command)
+        for error in errors:
+            print("Error: " + str(error), file=sys.stderr)
+    finally:
+        mapped.close()
+
+
+def run_input(system:Railway_System, source):
+    # the default driver: reads every command, sorts them in memory and runs them.
+    vehicle_records, vehicles_validity, commands_list, errors = read_input(source)
+
+    if load_vehicles(system, vehicle_records, vehicles_validity):
+        commands_list = sorted(commands_list, key=Railway_System.record_key)
+
+        for error in errors:
+            print("Error: " + str(error), file=sys.stderr)
+
+        for command in commands_list:
+            run_command(system, command)
+
+    # print("========================================================================================================")
+    # system.print_result()
+
+
+def what_if(system:Railway_System, rule_lines:list, sink:Result_Sink):
+    # the --what-if rules, applied one after another on one fork of the system.
+    fork = system.fork(sink)
+    try:
+        for index, line in enumerate(rule_lines):
+            try:
+                fork.apply(parse_command(line.split(), index))
+            except ValueError as error:
+                print("Error: what-if " + str(index) + ": " + str(error), file=sys.stderr)
+    finally:
+        fork.close()
+        sink.flush()
+
+
+# the --output choices of main.
+sinks = {"text": Text_Sink, "jsonl": Json_Lines_Sink}
+
+
+def main(argv:list = None):
+    parser = argparse.ArgumentParser(description="Runs the railway system over a command file.")
+    parser.add_argument("input", nargs="?", help="the command file, stdin if it is not given.")
+    parser.add_argument("--stream", action="store_true", help="run commands as they arrive instead of reading and sorting all of them first.")
+    parser.add_argument("--lateness", type=int, default=0, help="with --stream, how many minutes a command may arrive after a later one (default 0).")
+    parser.add_argument("--run-size", type=int, default=None, help="sort the commands on disk, in runs of this many commands, for inputs larger than memory.")
+    parser.add_argument("--mmap", action="store_true", help="map the input file into memory and decode only the command being run.")
+    parser.add_argument("--log", action="store_true", help="the input is a binary command log made by --convert.")
+    parser.add_argument("--convert", metavar="LOG", default=None, help="write the text input to a binary command log instead of running it.")
+    parser.add_argument("--timetable", metavar="CSV", default=None, help="add the departures of a timetable CSV before the vehicles of the input.")
+    parser.add_argument("--snapshot", metavar="PATH", default=None, help="save a snapshot of the state after the run.")
+    parser.add_argument("--restore", metavar="PATH", default=None, help="start from a snapshot and run only the commands after its watermark; the input is numbered on from it, so its commands in the watermark's minute run too.")
+    parser.add_argument("--what-if", metavar="RULE", action="append", default=[], help="after the run, write what this rule line (with its time) would cancel, without applying it; can be repeated.")
+    parser.add_argument("--journal", metavar="DIR", default=None, help="journal the changes to DIR, recovering the state already there first.")
+    parser.add_argument("--storage", choices=sorted(Railway_System.storages), default="objects", help="where the reservations are kept (default objects, in memory).")
+    parser.add_argument("--db", metavar="PATH", default=None, help="with --storage sqlite, the database file (default a private temporary one); it must not have reservations of another run.")
+    parser.add_argument("--db-batch", metavar="N", type=int, default=None, help="with --storage sqlite, commit the database every N changes (default 10000).")
+    parser.add_argument("--output", choices=sorted(sinks), default="text", help="text (the default) or jsonl, one JSON object per result.")
+    args = parser.parse_args(argv)
+    if (args.mmap or args.log) and args.input == None:
+        parser.error("--mmap and --log need an input file")
+
+    if args.convert != None:
+        convert_input(args.input if args.input != None else sys.stdin.buffer, args.convert)
+        return
+
+    storage_options:dict = {}
+    if args.db != None:
+        storage_options["path"] = args.db
+    if args.db_batch != None:
+        storage_options["batch_size"] = args.db_batch
+    if len(storage_options) != 0 and args.storage != "sqlite":
+        parser.error("--db and --db-batch need --storage sqlite")
+
+    ali_baba = None
+    try:
+        if args.restore != None:
+            ali_baba = Snapshot.restore(args.restore, args.storage, sinks[args.output](), storage_options)
+            ali_baba.continue_input()
+        elif args.journal != None:
+            ali_baba = Journal.recover(args.journal, args.storage, sinks[args.output](), storage_options)
+        if ali_baba == None:
+            ali_baba = Railway_System(args.storage, sinks[args.output](), storage_options)
+    except ValueError as error:
+        parser.error(str(error))
+    if args.journal != None:
+        Journal.attach(ali_baba, args.journal)
+    if args.timetable != None:
+        for row, message in ali_baba.import_timetable(read_timetable_csv(args.timetable)):
+            print("Error: timetable row " + str(row) + ": " + message, file=sys.stderr)
+    source = args.input if args.input != None else sys.stdin.buffer
+    try:
+        if args.stream:
+            stream_input(ali_baba, source, args.lateness)
+        elif args.log:
+            log_input(ali_baba, args.input)
+        elif args.mmap:
+            mapped_input(ali_baba, args.input)
+        elif args.run_size != None:
+            sorted_input(ali_baba, source, args.run_size)
         else:
-            ali_baba.cancel_reservation(command, commands_list)
+            run_input(ali_baba, source)
+    finally:
+        ali_baba.close()
+    if len(args.what_if) != 0:
+        what_if(ali_baba, args.what_if, sinks[args.output]())
+    if args.snapshot != None:
+        ali_baba.save_snapshot(args.snapshot)
 
 
-# print("========================================================================================================")
-# ali_baba.print_result()
\ No newline at end of file
+if __name__ == "__main__":
+    main()
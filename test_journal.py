@@ -0,0 +1,95 @@
+"""
+Crash tests of the Journal of railway_Phase3: the writer is killed and the state is recovered
+from the journal directory.
+
+usage: python -m unittest test_journal
+"""
+import os
+import shutil
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+from io import BytesIO, StringIO
+from unittest import mock
+
+from railway_Phase3 import Journal, Railway_System, Result_Collector, Text_Sink, parse_command, stream_input
+
+here = os.path.dirname(os.path.abspath(__file__))
+
+
+class Journal_Crash_Test(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_killed_after_results(self):
+        # every result the killed process wrote has its command in the journal.
+        writer = subprocess.Popen([sys.executable, os.path.join(here, "railway_Phase3.py"), "--stream", "--journal", self.directory],
+                                  stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True, bufsize=1)
+        writer.stdin.write("1\nTrain Tehran Shiraz 2023/05/10-10:00 5\n4\n")
+        writer.stdin.flush()
+        self.assertEqual(writer.stdout.readline().strip(), "Done")
+        for command in ("2023/05/01-10:00 ali Tehran Shiraz Train 30", "2023/05/01-10:01 reza Tehran Shiraz Train 40",
+                        "2023/05/01-10:02 sara Tehran Shiraz Train 50", "2023/05/01-10:03 ali Tehran Shiraz Train cancel"):
+            writer.stdin.write(command + "\n")
+            writer.stdin.flush()
+            self.assertIn("movafagh", writer.stdout.readline())
+        writer.send_signal(signal.SIGKILL)
+        writer.wait()
+        writer.stdin.close()
+        writer.stdout.close()
+
+        system = Journal.recover(self.directory, sink=Result_Collector())
+        self.assertEqual(system.occupancy_per_route(), {("Tehran", "Shiraz"): 2})
+        self.assertEqual(system.watermark[1], 3)
+
+    def test_idle_records_are_committed(self):
+        # records waiting for their batch are written once batch_interval passed, without another command.
+        system = Railway_System("objects", Result_Collector())
+        Journal.attach(system, self.directory, batch_size=256, batch_interval=0.05)
+        system.add_vehicle("Train Tehran Shiraz 2023/05/10-10:00 5".split())
+        for index, username in enumerate(("ali", "reza", "sara")):
+            system.execute(parse_command(("2023/05/01-10:0" + str(index) + " " + username + " Tehran Shiraz Train 30").split(), index))
+        time.sleep(20 * system.journal.batch_interval)
+
+        # the writer is gone without closing its journal.
+        recovered = Journal.recover(self.directory, sink=Result_Collector())
+        self.assertEqual(recovered.occupancy_per_route(), {("Tehran", "Shiraz"): 3})
+
+    def test_results_wait_for_their_records(self):
+        # a sink that writes every result at once still gets it only after the group commit.
+        out = StringIO()
+        system = Railway_System("objects", Text_Sink(out, buffer_size=1))
+        Journal.attach(system, self.directory, batch_size=256, batch_interval=10)
+        system.add_vehicle("Train Tehran Shiraz 2023/05/10-10:00 5".split())
+        system.execute(parse_command("2023/05/01-10:00 ali Tehran Shiraz Train 30".split(), 0))
+        system.flush()
+        self.assertEqual(out.getvalue(), "")
+        system.journal.close()
+        self.assertEqual(out.getvalue(), "Reserve karbar ali baraye belit train model Normal movafagh bood.\n")
+
+    def test_stream_group_commit(self):
+        # --stream flushes after every command, but the records still share their fsyncs.
+        lines = ["1", "Train Tehran Shiraz 2023/05/10-10:00 50", "40"]
+        lines += ["2023/05/01-10:" + str(10 + i) + " user" + str(i) + " Tehran Shiraz Train 30" for i in range(40)]
+        out = StringIO()
+        system = Railway_System("objects", Text_Sink(out))
+        Journal.attach(system, self.directory, batch_size=256, batch_interval=10)
+        fsync = os.fsync
+        calls:list = []
+        with mock.patch("os.fsync", lambda descriptor: calls.append(descriptor) or fsync(descriptor)):
+            stream_input(system, BytesIO(("\n".join(lines) + "\n").encode()), 0)
+            system.journal.close()
+        # the first checkpoint's snapshot and directory, and one group commit.
+        self.assertLessEqual(len(calls), 3)
+        self.assertEqual(out.getvalue().count("movafagh bood"), 40)
+
+
+if __name__ == "__main__":
+    unittest.main()